@@ -47,21 +47,43 @@ was written by Jeff Waugh and is available at www.perkypants.org
 
 from __future__ import print_function, unicode_literals
 
+import bz2
 import gzip
+import hashlib
 import io
 import itertools
+import json
+import keyword
+import mmap
+import multiprocessing
 import optparse
 import os
 import re
 import shlex
 import shutil
+import stat
+import string
 import sys
+import tempfile
+import uuid
+import zlib
+from array import array
+from contextlib import closing
+from json.encoder import encode_basestring
 
 try:
     from urllib import quote
 except ImportError:
     from urllib.parse import quote
 
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
 from ._version import __version__ as VERSION, __date__ as RELEASE
 
 try:
@@ -103,6 +125,13 @@ class LogParser(object):
         time, SERVER, text
 
     Text is a pure ASCII or Unicode string.
+
+    When parsing a file, you can skip the part you've already parsed by
+    passing its length as ``offset``.  After iteration ``offset`` is the
+    position just after the last complete line, and ``partial`` tells
+    whether an event was produced from an incomplete line after it (a log
+    that is being written to might not end with a newline).  These are
+    not tracked when parsing an iterable of lines.
     """
 
     COMMENT = Enum('COMMENT')
@@ -118,18 +147,127 @@ class LogParser(object):
         r'(?:\d{4}-\d{2}-\d{2}T|\d{2}-\w{3}-\d{4} |\w{3} \d{2} |\d{2} \w{3} )?' # Optional date
         r'\d\d:\d\d(:\d\d)?' # Mandatory HH:MM, optional :SS
         r')\]? +') # Optional ], mandatory space
+    # Specialised versions of TIME_REGEXP, one for every date format it
+    # accepts.  Each file is usually written by one IRC client, so we pick
+    # the one that matches the first lines of the file and fall back to
+    # TIME_REGEXP for lines it doesn't match.
+    TIME_FORMATS = [
+        # 2005-01-08T23:47:19 (ISO 8601, e.g. supybot)
+        re.compile(r'^\[?(\d{4}-\d{2}-\d{2}T\d\d:\d\d(:\d\d)?)\]? +'),
+        # 08-Jan-2005 23:47
+        re.compile(r'^\[?(\d{2}-\w{3}-\d{4} \d\d:\d\d(:\d\d)?)\]? +'),
+        # Jan 08 23:47:19 (xchat)
+        re.compile(r'^\[?(\w{3} \d{2} \d\d:\d\d(:\d\d)?)\]? +'),
+        # 08 Jan 23:47
+        re.compile(r'^\[?(\d{2} \w{3} \d\d:\d\d(:\d\d)?)\]? +'),
+        # 23:47 or [23:47:19] (irssi, dircproxy and many others)
+        re.compile(r'^\[?(\d\d:\d\d(:\d\d)?)\]? +'),
+    ]
     NICK_REGEXP = re.compile(r'^<(.*?)(!.*?)?>\s')
     DIRCPROXY_NICK_REGEXP = re.compile(r'^<(.*?)(!.*)?>\s[\+-]?')
+    ACTION_REGEXP = re.compile(r'^\*[ \t]')
     JOIN_REGEXP = re.compile(r'^(?:\*\*\*|-->)\s.*joined')
     PART_REGEXP = re.compile(r'^(?:\*\*\*|<--)\s.*(quit|left)')
     SERVMSG_REGEXP = re.compile(r'^(?:\*\*\*|---)\s')
     NICK_CHANGE_REGEXP = re.compile(
         r'^(?:\*\*\*|---)\s+(.*?) (?:are|is) now known as (.*)')
 
-    def __init__(self, infile, dircproxy=False):
+    # Line classifiers in the order they're tried, with the first characters
+    # of the lines each of them can possibly match.  Lines starting with any
+    # other character are OTHER.
+    CLASSIFIERS = [
+        ('NICK_REGEXP', COMMENT, '<'),
+        ('ACTION_REGEXP', ACTION, '*'),
+        ('JOIN_REGEXP', JOIN, '*-'),
+        ('PART_REGEXP', PART, '*<'),
+        ('NICK_CHANGE_REGEXP', NICKCHANGE, '*-'),
+        ('SERVMSG_REGEXP', SERVER, '*-'),
+    ]
+
+    # How many bytes to read and decode at a time
+    CHUNK_SIZE = 64 * 1024
+
+    # How many lines to look at when choosing the time format
+    SNIFF_LINES = 50
+
+    def __init__(self, infile, dircproxy=False, offset=0):
         self.infile = infile
+        self.offset = offset
+        self.partial = False
+        if offset:
+            infile.seek(offset)
         if dircproxy:
             self.NICK_REGEXP = self.DIRCPROXY_NICK_REGEXP
+        self.dispatch = self.build_dispatch_table()
+
+    def build_dispatch_table(self):
+        """Combine the line classifiers into one regexp per first character.
+
+        Returns a dict mapping the first character of a line to a tuple
+        (regexp, events), where regexp is an alternation of all the
+        classifiers applicable to that character, each wrapped in a group,
+        and events maps the number of that group to the event it signifies.
+        The group numbers of the classifier's own groups follow it.
+
+        Regexps that can't be pasted into a bigger one (see can_combine)
+        are not combined: for characters that need any of them, regexp is
+        None and events is a list of (regexp, event) to try in turn.
+        """
+        table = {}
+        first_chars = set(''.join(chars for attr, event, chars
+                                  in self.CLASSIFIERS))
+        for char in first_chars:
+            classifiers = [(attr, getattr(self, attr), event)
+                           for attr, event, chars in self.CLASSIFIERS
+                           if char in chars]
+            alternatives = []
+            events = {}
+            ngroups = 0
+            for attr, regexp, event in classifiers:
+                alternatives.append('(%s)' % regexp.pattern)
+                events[ngroups + 1] = event
+                ngroups += 1 + regexp.groups
+            combined = None
+            if all(self.can_combine(attr, regexp)
+                   for attr, regexp, event in classifiers):
+                try:
+                    combined = re.compile('|'.join(alternatives))
+                except re.error:
+                    # e.g. two of them define a group with the same name
+                    pass
+            if combined is not None:
+                table[char] = (combined, events)
+            else:
+                table[char] = (None, [(regexp, event) for attr, regexp, event
+                                      in classifiers])
+        return table
+
+    def can_combine(self, attr, regexp):
+        """Check whether a classifier regexp can be part of a combined one.
+
+        Flags (passed to re.compile() or written inline) would be lost or
+        misplaced, numbered backreferences would point to the wrong groups,
+        and a different number of groups than LogParser's own regexp has
+        means the regexp expects its groups to be used in some other way.
+        """
+        default = getattr(LogParser, attr, None)
+        return (default is not None
+                and regexp.groups == default.groups
+                and regexp.flags == re.compile(regexp.pattern[:0]).flags
+                and not re.search(r'\\[1-9]', regexp.pattern))
+
+    def sniff_time_regexp(self, lines):
+        """Pick the regexp for timestamps that suits the given lines best."""
+        counts = [0] * len(self.TIME_FORMATS)
+        for line in itertools.islice(lines, self.SNIFF_LINES):
+            for n, regexp in enumerate(self.TIME_FORMATS):
+                if regexp.match(line):
+                    counts[n] += 1
+                    break
+        best = max(counts)
+        if not best:
+            return self.TIME_REGEXP
+        return self.TIME_FORMATS[counts.index(best)]
 
     @staticmethod
     def decode(s):
@@ -146,53 +284,855 @@ class LogParser(object):
         except UnicodeError:
             return s.decode('cp1252', 'replace')
 
+    @classmethod
+    def decode_chunk(cls, chunk):
+        """Convert a chunk of 8-bit text consisting of whole lines to Unicode.
+
+        Gives the same result as decoding every line with decode(), but
+        decodes as much of the chunk as possible as UTF-8 in one go.  Only
+        the lines starting with the first one that is not valid UTF-8 are
+        passed to decode() one by one.
+        """
+        if isinstance(chunk, unicode):
+            return chunk
+        try:
+            return chunk.decode('UTF-8')
+        except UnicodeDecodeError as e:
+            # A newline can never be a part of a multibyte UTF-8 sequence,
+            # so everything before the line containing the error is valid.
+            start = chunk.rfind(b'\n', 0, e.start) + 1
+            return chunk[:start].decode('UTF-8') + '\n'.join(
+                cls.decode(line) for line in chunk[start:].split(b'\n'))
+
+    def read_blocks(self):
+        """Iterate over blocks of lines of the input file.
+
+        Each block is an iterable of lines converted to Unicode.  Files
+        (anything with a read() method) are read and decoded in chunks of
+        about CHUNK_SIZE bytes, each chunk producing a list of lines.  Files
+        that know how to split themselves into chunks of whole lines can
+        provide a read_chunks(size) method of their own.  Other iterables
+        are assumed to produce lines, which are decoded one by one.
+        """
+        if hasattr(self.infile, 'read_chunks'):
+            chunks = self.infile.read_chunks(self.CHUNK_SIZE)
+        elif hasattr(self.infile, 'read'):
+            chunks = read_chunks(self.infile, self.CHUNK_SIZE)
+        else:
+            lines = iter(map(self.decode, self.infile))
+            yield list(itertools.islice(lines, self.SNIFF_LINES))
+            yield lines
+            return
+        for chunk in chunks:
+            lines = self.decode_chunk(chunk).split('\n')
+            complete = not lines[-1]
+            if complete:
+                del lines[-1]
+            else:
+                self.partial = bool(lines[-1].rstrip('\r'))
+            yield lines
+            if complete:
+                self.offset += len(chunk)
+
     def __iter__(self):
-        for line in self.infile:
-            line = self.decode(line).rstrip('\r\n')
+        blocks = self.read_blocks()
+        first_block = next(blocks, [])
+        time_regexp = self.sniff_time_regexp(first_block)
+        if time_regexp is self.TIME_REGEXP:
+            fallback_time_regexp = None
+        else:
+            fallback_time_regexp = self.TIME_REGEXP
+        dispatch = self.dispatch
+        for line in itertools.chain(first_block,
+                                    itertools.chain.from_iterable(blocks)):
+            line = line.rstrip('\r\n')
             if not line:
                 continue
 
-            m = self.TIME_REGEXP.match(line)
+            m = time_regexp.match(line)
+            if not m and fallback_time_regexp is not None:
+                m = fallback_time_regexp.match(line)
             if m:
                 time = m.group(1)
-                line = line[len(m.group(0)):]
+                line = line[m.end():]
             else:
                 time = None
 
-            m = self.NICK_REGEXP.match(line)
-            if m:
-                nick = m.group(1)
-                text = line[len(m.group(0)):]
-                yield time, self.COMMENT, (nick, text)
-            elif line.startswith('* ') or line.startswith('*\t'):
-                yield time, self.ACTION, line
-            elif self.JOIN_REGEXP.match(line):
-                yield time, self.JOIN, line
-            elif self.PART_REGEXP.match(line):
-                yield time, self.PART, line
+            try:
+                regexp, events = dispatch[line[:1]]
+            except KeyError:
+                yield time, self.OTHER, line
+                continue
+            if regexp is not None:
+                m = regexp.match(line)
+                if not m:
+                    yield time, self.OTHER, line
+                    continue
+                n = m.lastindex
+                what = events[n]
             else:
-                m = self.NICK_CHANGE_REGEXP.match(line)
-                if m:
-                    oldnick = m.group(1)
-                    newnick = m.group(2)
-                    line = line
-                    yield time, self.NICKCHANGE, (line, oldnick, newnick)
-                elif self.SERVMSG_REGEXP.match(line):
-                    yield time, self.SERVER, line
+                for regexp, what in events:
+                    m = regexp.match(line)
+                    if m:
+                        break
                 else:
                     yield time, self.OTHER, line
+                    continue
+                n = 0
+            if what is self.COMMENT:
+                nick = m.group(n + 1)
+                text = line[m.end():]
+                yield time, what, (nick, text)
+            elif what is self.NICKCHANGE:
+                oldnick = m.group(n + 1)
+                newnick = m.group(n + 2)
+                yield time, what, (line, oldnick, newnick)
+            else:
+                yield time, what, line
+
+
+# Text offsets of a ParsedLog need 64 bits: a log file that spans a few years
+# can have more than 2**32 characters.  Python 2's array module has no 'Q',
+# but its 'L' is 64-bit on most platforms (and where it isn't, appending a
+# larger offset raises OverflowError rather than wrapping around).
+try:
+    OFFSET_TYPECODE = array(str('Q')).typecode
+except ValueError:
+    OFFSET_TYPECODE = array(str('L')).typecode
+
+
+class ParsedLog(object):
+    """A parsed IRC log file stored in columns.
+
+    Holds the same events LogParser produces, but instead of a tuple (and
+    a couple of strings) per event it keeps
+
+      - the event codes in an array of bytes (an index into EVENTS),
+      - the timestamps in an array of indices into a table of distinct
+        timestamps (timestamps are kept as strings, because the log formats
+        differ and the formatters show them the way they were written),
+      - the nicks of COMMENT and NICKCHANGE events in an array of indices
+        into a table of distinct nicks, with the new nicks of NICKCHANGE
+        events in a dict keyed by event number,
+      - all the message texts in a single string, with an array of offsets.
+
+    When iterated, yields the same (time, event, info) tuples as LogParser,
+    so it can be passed to convert_irc_log() instead of a parser.
+
+    ``uid`` stays the same while events are only appended, so whoever
+    processed the first N events can tell that they need to look only at
+    the rest.
+    """
+
+    EVENTS = (LogParser.COMMENT, LogParser.ACTION, LogParser.JOIN,
+              LogParser.PART, LogParser.NICKCHANGE, LogParser.SERVER,
+              LogParser.OTHER)
+
+    ARRAYS = ('events', 'times', 'nicks', 'offsets')
+
+    def __init__(self, events=()):
+        self.events = array(str('b'))
+        self.times = array(str('i'))
+        self.nicks = array(str('i'))
+        self.newnicks = {}
+        self.time_table = []
+        self.nick_table = []
+        self.text = ''
+        self.offsets = array(OFFSET_TYPECODE, [0])
+        self.uid = uuid.uuid4().hex
+        self._build_indices()
+        self.extend(events)
+
+    def _build_indices(self):
+        self._event_codes = dict((event, code)
+                                 for code, event in enumerate(self.EVENTS))
+        self._time_index = dict((time, n)
+                                for n, time in enumerate(self.time_table))
+        self._nick_index = dict((nick, n)
+                                for n, nick in enumerate(self.nick_table))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_event_codes', '_time_index', '_nick_index'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_indices()
+
+    def _intern(self, value, table, index):
+        try:
+            return index[value]
+        except KeyError:
+            n = index[value] = len(table)
+            table.append(value)
+            return n
+
+    def extend(self, events):
+        """Append events produced by a LogParser (or another ParsedLog)."""
+        if isinstance(events, ParsedLog):
+            self._extend_parsed(events)
+            return
+        texts = []
+        offset = self.offsets[-1]
+        n = len(self.events)
+        event_codes = self._event_codes
+        time_index = self._time_index
+        nick_index = self._nick_index
+        for time, event, info in events:
+            if time is None:
+                self.times.append(-1)
+            else:
+                self.times.append(self._intern(time, self.time_table,
+                                               time_index))
+            self.events.append(event_codes[event])
+            if event is LogParser.COMMENT:
+                nick, text = info
+                self.nicks.append(self._intern(nick, self.nick_table,
+                                               nick_index))
+            elif event is LogParser.NICKCHANGE:
+                text, oldnick, newnick = info
+                self.nicks.append(self._intern(oldnick, self.nick_table,
+                                               nick_index))
+                self.newnicks[n] = self._intern(newnick, self.nick_table,
+                                                nick_index)
+            else:
+                text = info
+                self.nicks.append(-1)
+            texts.append(text)
+            offset += len(text)
+            self.offsets.append(offset)
+            n += 1
+        if texts:
+            self.text += ''.join(texts)
+
+    def _extend_parsed(self, other):
+        n = len(self.events)
+        time_map = [self._intern(time, self.time_table, self._time_index)
+                    for time in other.time_table]
+        nick_map = [self._intern(nick, self.nick_table, self._nick_index)
+                    for nick in other.nick_table]
+        self.events.extend(other.events)
+        self.times.extend(array(str('i'), [time_map[t] if t >= 0 else -1
+                                           for t in other.times]))
+        self.nicks.extend(array(str('i'), [nick_map[k] if k >= 0 else -1
+                                           for k in other.nicks]))
+        for k, newnick in other.newnicks.items():
+            self.newnicks[n + k] = nick_map[newnick]
+        base = self.offsets[-1]
+        self.offsets.extend(array(OFFSET_TYPECODE, [base + offset for offset
+                                                    in other.offsets[1:]]))
+        self.text += other.text
+
+    def truncate(self, length):
+        """Drop all events after the first ``length``."""
+        if length >= len(self.events):
+            return
+        del self.events[length:]
+        del self.times[length:]
+        del self.nicks[length:]
+        del self.offsets[length + 1:]
+        for n in [n for n in self.newnicks if n >= length]:
+            del self.newnicks[n]
+        self.text = self.text[:self.offsets[-1]]
+        self.uid = uuid.uuid4().hex
+
+    def __len__(self):
+        return len(self.events)
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += len(self.events)
+        if not 0 <= n < len(self.events):
+            raise IndexError(n)
+        return self._event(n)
+
+    def _event(self, n):
+        time = self.times[n]
+        time = self.time_table[time] if time >= 0 else None
+        event = self.EVENTS[self.events[n]]
+        text = self.text[self.offsets[n]:self.offsets[n + 1]]
+        if event is LogParser.COMMENT:
+            return time, event, (self.nick_table[self.nicks[n]], text)
+        elif event is LogParser.NICKCHANGE:
+            return time, event, (text, self.nick_table[self.nicks[n]],
+                                 self.nick_table[self.newnicks[n]])
+        else:
+            return time, event, text
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        """Iterate over events, skipping the first ``start``."""
+        for n in range(start, len(self.events)):
+            yield self._event(n)
+
+    def dump(self, f):
+        """Write the parsed log to a binary file.
+
+        The format is a line of JSON with the nick and timestamp tables,
+        followed by the raw contents of the arrays, followed by the text
+        encoded in UTF-8.  It is not portable between machines with
+        different byte orders.
+        """
+        text = self.text.encode('UTF-8')
+        arrays = [(name, getattr(self, name)) for name in self.ARRAYS]
+        header = {
+            'byteorder': sys.byteorder,
+            'arrays': [[name, a.typecode, a.itemsize, len(a)]
+                       for name, a in arrays],
+            'time_table': self.time_table,
+            'nick_table': self.nick_table,
+            'newnicks': sorted(self.newnicks.items()),
+            'text': len(text),
+            'uid': self.uid,
+        }
+        f.write(json.dumps(header, sort_keys=True).encode('ascii') + b'\n')
+        for name, a in arrays:
+            if hasattr(a, 'tobytes'):
+                f.write(a.tobytes())
+            else:
+                f.write(a.tostring()) # Python 2
+        f.write(text)
+
+    @classmethod
+    def load(cls, f):
+        """Read a parsed log written by dump().
+
+        Raises ValueError if the file is truncated or was written on an
+        incompatible machine.
+        """
+        try:
+            header = json.loads(f.readline().decode('ascii'))
+        except UnicodeError:
+            raise ValueError('not a parsed log')
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('byte order mismatch')
+        log = cls()
+        for name, typecode, itemsize, length in header['arrays']:
+            if name not in cls.ARRAYS:
+                raise ValueError('unknown array: %s' % name)
+            a = array(str(typecode))
+            if a.typecode != getattr(log, name).typecode:
+                raise ValueError('type code mismatch')
+            if a.itemsize != itemsize:
+                raise ValueError('item size mismatch')
+            data = f.read(itemsize * length)
+            if len(data) != itemsize * length:
+                raise ValueError('truncated file')
+            if hasattr(a, 'frombytes'):
+                a.frombytes(data)
+            else:
+                a.fromstring(data) # Python 2
+            setattr(log, name, a)
+        log.time_table = header['time_table']
+        log.nick_table = header['nick_table']
+        log.newnicks = dict(header['newnicks'])
+        text = f.read(header['text'])
+        if len(text) != header['text']:
+            raise ValueError('truncated file')
+        log.text = text.decode('UTF-8')
+        log.uid = header['uid']
+        log._build_indices()
+        return log
+
+
+class ParseCache(object):
+    """A directory of parsed log files.
+
+    parse() returns a ParsedLog for a log file, parsing it only if the
+    file has changed (or was never seen before), and then only the lines
+    that were appended to it.  Each log file gets its
+    own cache file, named after a hash of the log file's absolute path, so
+    several programs can share a cache directory.  Cache files are replaced
+    atomically, and are readable by the same people as the log file.
+    """
+
+    MAGIC = b'irclog2html parse cache\n'
+
+    # How many bytes before the end of the parsed part of a log file must
+    # stay the same for us to believe the file was only appended to
+    TAIL_SIZE = 1024
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def cache_filename(self, filename, dircproxy=False):
+        key = os.path.abspath(filename)
+        if dircproxy:
+            key += '\0dircproxy'
+        if isinstance(key, unicode):
+            key = key.encode('UTF-8', 'replace')
+        return os.path.join(self.directory,
+                            hashlib.sha1(key).hexdigest() + '.parsed')
+
+    def entry_header(self, filename, dircproxy):
+        """Identify the log file a cache file describes."""
+        path = os.path.abspath(filename)
+        if not isinstance(path, unicode):
+            path = path.decode(sys.getfilesystemencoding() or 'UTF-8',
+                               'replace') # Python 2
+        return {
+            'path': path,
+            'dircproxy': dircproxy,
+            'version': VERSION,
+        }
+
+    def parse(self, filename, dircproxy=False, use_mmap=False):
+        """Parse a log file, or load it from the cache if it's unchanged.
+
+        If the log file has grown since it was cached, only the new lines
+        are parsed.  The log file is memory-mapped if ``use_mmap`` is true
+        (see open_log_file).
+        """
+        st = os.stat(filename)
+        header = self.entry_header(filename, dircproxy)
+        cache_filename = self.cache_filename(filename, dircproxy)
+        state, log = self.load(cache_filename, header)
+        if (log is not None and state['size'] == st.st_size
+                and state['mtime'] == st.st_mtime):
+            return log
+        # Nobody appends to compressed files, and seeking backwards in them
+        # means decompressing everything again, so they're always parsed
+        # from the start.
+        resumable = not compression_extension(filename)
+        with closing(open_log_file(filename, use_mmap=use_mmap)) as f:
+            if (log is not None and resumable
+                    and self.can_resume(f, state, st)):
+                if state['partial']:
+                    # the incomplete last line will be parsed again
+                    log.truncate(len(log) - 1)
+                parser = LogParser(f, dircproxy=dircproxy,
+                                   offset=state['offset'])
+                log.extend(parser)
+            else:
+                f.seek(0)
+                parser = LogParser(f, dircproxy=dircproxy)
+                log = ParsedLog(parser)
+            state = {
+                'size': st.st_size,
+                'mtime': st.st_mtime,
+                'offset': parser.offset,
+                'partial': parser.partial,
+                'tail': (self.tail_hash(f, parser.offset) if resumable
+                         else None),
+            }
+        self.save(cache_filename, dict(header, **state), log,
+                  stat.S_IMODE(st.st_mode))
+        return log
+
+    def tail_hash(self, f, offset):
+        """Compute a checksum of the last line(s) before ``offset``.
+
+        """
+        start = max(0, offset - self.TAIL_SIZE)
+        f.seek(start)
+        return hashlib.sha1(f.read(offset - start)).hexdigest()
+
+    def can_resume(self, f, state, st):
+        """Check whether a log file was only appended to since it was cached.
+        """
+        return (state['tail'] is not None and st.st_size >= state['size']
+                and self.tail_hash(f, state['offset']) == state['tail'])
+
+    def load(self, cache_filename, header):
+        """Load a parsed log from the cache.
+
+        Returns a tuple (state, log), where state describes the version of
+        the log file that was parsed.  Returns (None, None) if the cache file
+        is missing, damaged, or describes a different log file than
+        ``header``.
+        """
+        try:
+            with io.open(cache_filename, 'rb') as f:
+                if f.readline() != self.MAGIC:
+                    return None, None
+                state = json.loads(f.readline().decode('UTF-8'))
+                for key, value in header.items():
+                    if state[key] != value:
+                        return None, None
+                return state, ParsedLog.load(f)
+        except (EnvironmentError, ValueError, KeyError):
+            return None, None
+
+    def save(self, cache_filename, header, log, mode=0o644):
+        """Store a parsed log in the cache.
+
+        Failures are ignored: the cache is only an optimization.
+        """
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmpname = tempfile.mkstemp(prefix='.', suffix='.tmp',
+                                           dir=self.directory)
+        except EnvironmentError:
+            return
+        try:
+            with io.open(fd, 'wb') as f:
+                f.write(self.MAGIC)
+                f.write(json.dumps(header, sort_keys=True).encode('UTF-8')
+                        + b'\n')
+                log.dump(f)
+            os.chmod(tmpname, mode & 0o666)
+            # os.rename() can't overwrite files on Windows; os.replace()
+            # is Python 3.3+
+            getattr(os, 'replace', os.rename)(tmpname, cache_filename)
+        except EnvironmentError:
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+
+
+def split_log_file(filename, pieces, min_size=1024 * 1024):
+    """Split a log file into byte ranges that start and end on line breaks.
+
+    Returns a list of up to ``pieces`` tuples (start, end), but doesn't make
+    pieces smaller than ``min_size`` bytes.
+    """
+    size = os.path.getsize(filename)
+    pieces = max(1, min(pieces, size // max(1, min_size)))
+    ranges = []
+    start = 0
+    with map_log_file(filename) as f:
+        for n in range(1, pieces):
+            end = f.map.find(b'\n', max(start, size * n // pieces)) + 1
+            if not end:
+                break
+            ranges.append((start, end))
+            start = end
+    if start < size or not ranges:
+        ranges.append((start, size))
+    return ranges
+
+
+def parse_log_range(args):
+    """Parse a byte range of a log file into a ParsedLog.
+
+    Takes a single tuple (filename, start, end, dircproxy), so it can be
+    used with multiprocessing.Pool.map().
+    """
+    filename, start, end, dircproxy = args
+    with map_log_file(filename) as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return ParsedLog(LogParser(io.BytesIO(data), dircproxy=dircproxy))
+
+
+def parse_log_file_in_parallel(filename, jobs, dircproxy=False,
+                               min_size=1024 * 1024):
+    """Parse a large uncompressed log file using several processes.
+
+    Returns a ParsedLog with the same events LogParser would produce.
+    """
+    if (compression_extension(filename)
+            or not stat.S_ISREG(os.stat(filename).st_mode)):
+        # can't split a compressed file without decompressing it, or a pipe
+        # without reading it
+        with closing(open_log_file(filename)) as f:
+            return ParsedLog(LogParser(f, dircproxy=dircproxy))
+    ranges = split_log_file(filename, jobs, min_size)
+    if len(ranges) == 1:
+        return parse_log_range((filename, 0, ranges[0][1], dircproxy))
+    pool = multiprocessing.Pool(min(jobs, len(ranges)))
+    try:
+        pieces = pool.map(parse_log_range,
+                          [(filename, start, end, dircproxy)
+                           for start, end in ranges])
+    finally:
+        pool.close()
+        pool.join()
+    log = pieces[0]
+    for piece in pieces[1:]:
+        log.extend(piece)
+    return log
+
+
+def read_chunks(infile, size):
+    """Read a file in chunks of whole lines.
+
+    Reads ``size`` bytes at a time and cuts them at the last newline,
+    carrying the rest over to the next chunk.  The last chunk will not end
+    with a newline if the file doesn't.
+    """
+    tail = None
+    while True:
+        chunk = infile.read(size)
+        if not chunk:
+            break
+        if tail:
+            chunk = tail + chunk
+        newline = '\n' if isinstance(chunk, unicode) else b'\n'
+        cut = chunk.rfind(newline) + 1
+        tail = chunk[cut:]
+        if cut:
+            yield chunk[:cut]
+    if tail:
+        yield tail
+
+
+class MappedLogFile(object):
+    """An uncompressed log file mapped into memory.
+
+    Provides enough of the binary file API for LogParser: iteration over
+    lines, read(), seek() and tell(), and also read_chunks(), which cuts
+    chunks of whole lines directly out of the mapping by scanning for
+    newlines, without an intermediate buffer.
+
+    ``f`` is an open binary file; it can be closed as soon as the mapping
+    is created.  Only regular files can be mapped: pipes and other special
+    files report a size of 0, so they raise ValueError instead of looking
+    empty.
+    """
+
+    def __init__(self, f):
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode):
+            raise ValueError('cannot map %s: not a regular file'
+                             % getattr(f, 'name', f))
+        self.size = st.st_size
+        if self.size:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # You cannot map an empty file
+            self.map = b''
+        self.pos = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            if self.size:
+                self.map.close()
+            self.closed = True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.size
+        self.pos = max(0, pos)
+        return self.pos
+
+    def read(self, size=-1):
+        start = self.pos
+        if size < 0:
+            self.pos = self.size
+        else:
+            self.pos = min(self.size, start + size)
+        return self.map[start:self.pos]
+
+    def read_chunks(self, size):
+        """Iterate over chunks of whole lines about ``size`` bytes long."""
+        while self.pos < self.size:
+            start = self.pos
+            end = self.map.rfind(b'\n', start, start + size) + 1
+            if not end:
+                # a line longer than size (or the last line without a
+                # trailing newline)
+                end = self.map.find(b'\n', start + size) + 1 or self.size
+            self.pos = end
+            yield self.map[start:end]
+
+    def __iter__(self):
+        while self.pos < self.size:
+            start = self.pos
+            self.pos = self.map.find(b'\n', start) + 1 or self.size
+            yield self.map[start:self.pos]
+
+
+def map_log_file(filename):
+    """Map a regular, uncompressed log file into memory."""
+    with io.open(filename, 'rb') as f:
+        return MappedLogFile(f)
+
+
+class StreamDecompressor(object):
+    """A compressed file, decompressed on the fly.
+
+    Reads the compressed file in large blocks and feeds them to a
+    decompressor object (like zlib.decompressobj() or bz2.BZ2Decompressor()).
+    Files consisting of several compressed streams one after another are
+    supported.  Seeking backwards means decompressing from the start again.
+
+    A file that ends in the middle of a compressed stream raises EOFError
+    (like gzip does) instead of looking like a shorter log.
+    """
+
+    # How many bytes of compressed data to read at a time
+    READ_SIZE = 256 * 1024
+
+    def __init__(self, filename, new_decompressor):
+        self.name = filename
+        self.new_decompressor = new_decompressor
+        self.raw = io.open(filename, 'rb', buffering=0)
+        self.rewind()
+
+    def rewind(self):
+        self.raw.seek(0)
+        self.decompressor = self.new_decompressor()
+        self.buffer = b''
+        self.bufpos = 0
+        self.pos = 0
+        self.eof = False
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.raw.close()
+
+    def decompress(self, data):
+        decompressor = self.decompressor
+        if getattr(decompressor, 'eof', False):
+            # the previous stream ended exactly at the end of a block
+            decompressor = self.decompressor = self.new_decompressor()
+        try:
+            result = decompressor.decompress(data)
+        except EOFError:
+            # Python 2 doesn't have .eof
+            decompressor = self.decompressor = self.new_decompressor()
+            result = decompressor.decompress(data)
+        while decompressor.unused_data:
+            data = decompressor.unused_data
+            decompressor = self.decompressor = self.new_decompressor()
+            result += decompressor.decompress(data)
+        return result
+
+    def fill(self, size):
+        """Decompress until at least size bytes are buffered, or until EOF."""
+        pieces = [self.buffer[self.bufpos:]]
+        have = len(pieces[0])
+        while not self.eof and (size < 0 or have < size):
+            data = self.raw.read(self.READ_SIZE)
+            if not data:
+                self.eof = True
+                if hasattr(self.decompressor, 'flush'):
+                    pieces.append(self.decompressor.flush())
+                # Python 2's decompressors don't have .eof, so truncated
+                # files cannot be detected there
+                if (self.raw.tell()
+                        and not getattr(self.decompressor, 'eof', True)):
+                    raise EOFError('Compressed file ended before the'
+                                   ' end-of-stream marker was reached')
+                break
+            pieces.append(self.decompress(data))
+            have += len(pieces[-1])
+        self.buffer = b''.join(pieces)
+        self.bufpos = 0
+
+    def read(self, size=-1):
+        if size < 0 or len(self.buffer) - self.bufpos < size:
+            self.fill(size)
+        if size < 0:
+            size = len(self.buffer) - self.bufpos
+        start = self.bufpos
+        data = self.buffer[start:start + size]
+        self.bufpos += len(data)
+        self.pos += len(data)
+        return data
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence != 0:
+            raise IOError('can only seek relative to the start or the'
+                          ' current position')
+        if pos < self.pos:
+            self.rewind()
+        while self.pos < pos and self.read(min(pos - self.pos,
+                                               self.READ_SIZE)):
+            pass
+        return self.pos
+
+    def __iter__(self):
+        for chunk in read_chunks(self, self.READ_SIZE):
+            lines = chunk.split(b'\n')
+            last = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+            if last:
+                yield last
+
+
+def open_gzip(filename):
+    return gzip.open(filename, 'rb')
+
+
+def open_bz2(filename):
+    return StreamDecompressor(filename, bz2.BZ2Decompressor)
+
+
+def open_xz(filename):
+    if lzma is None:
+        raise IOError('cannot read %s: xz support needs the lzma module'
+                      % filename)
+    return StreamDecompressor(filename, lzma.LZMADecompressor)
+
+
+def open_zlib(filename):
+    return StreamDecompressor(filename, zlib.decompressobj)
+
+
+# Supported kinds of compressed log files: file name extensions and functions
+# that open files for reading.  You can add more.
+DECOMPRESSORS = [
+    ('.gz', open_gzip),
+    ('.bz2', open_bz2),
+    ('.xz', open_xz),
+    ('.zz', open_zlib),
+]
 
 
-def open_log_file(filename):
-    """Open a log file for parsing."""
+def compression_extension(filename):
+    """Return the extension of a compressed log file, or '' if it isn't."""
+    for extension, opener in DECOMPRESSORS:
+        if filename.endswith(extension):
+            return extension
+    return ''
+
+
+def open_log_file(filename, use_mmap=False):
+    """Open a log file for parsing.
+
+    Compressed log files (see DECOMPRESSORS) are decompressed on the fly.
+    Uncompressed log files are memory-mapped if ``use_mmap`` is true and
+    they are regular files.  Don't map files that might be truncated while
+    you read them (e.g. in a long-running server): that crashes the
+    process with SIGBUS.
+    """
     # We're dealing with text here.  Why open the file in binary mode?
     # Simple: the Latin/Unicode hybrid encoding monstrosity described
     # at http://xchat.org/encoding/#hybrid.  Python doesn't support this
     # natively, so we have to do the decoding ourselves.
-    if filename.endswith('.gz'):
-        return gzip.open(filename, 'rb')
-    else:
-        return io.open(filename, 'rb')
+    for extension, opener in DECOMPRESSORS:
+        if filename.endswith(extension):
+            return opener(filename)
+    f = io.open(filename, 'rb')
+    if use_mmap and stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+        with f:
+            return MappedLogFile(f)
+    return f
 
 
 def shorttime(time):
@@ -213,6 +1153,51 @@ def shorttime(time):
     return time
 
 
+MONTHS = dict((name, n) for n, name in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+     'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1))
+
+
+def isotime(time):
+    """Convert a timestamp to ISO 8601.
+
+        >>> print(isotime('2005-01-08T23:47:19'))
+        2005-01-08T23:47:19
+        >>> print(isotime('08-Jan-2005 23:47'))
+        2005-01-08T23:47
+        >>> print(isotime('Jan 08 23:47:19'))
+        --01-08T23:47:19
+        >>> print(isotime('08 Jan 23:47'))
+        --01-08T23:47
+        >>> print(isotime('23:47'))
+        23:47
+
+    Dates without a year use the ISO 8601 ``--MM-DD`` form.  Timestamps
+    with month names other than the English abbreviations are returned
+    unchanged.
+
+        >>> print(isotime('08 Sty 23:47'))
+        08 Sty 23:47
+
+    """
+    if ' ' not in time:
+        return time
+    parts = time.replace('-', ' ').split()
+    if len(parts) == 4:
+        day, month, year, hhmm = parts
+    elif len(parts) == 3 and parts[0].isdigit():
+        day, month, hhmm = parts
+        year = '-'
+    elif len(parts) == 3:
+        month, day, hhmm = parts
+        year = '-'
+    else:
+        return time
+    if month not in MONTHS:
+        return time
+    return '%s-%02d-%sT%s' % (year, MONTHS[month], day, hhmm)
+
+
 #
 # Colouring stuff
 #
@@ -304,10 +1289,54 @@ class NickColourizer:
             self.nick_colour[newnick] = self.nick_colour.pop(oldnick)
 
 
+class HashNickColourizer:
+    """Choose stable colours for nicknames.
+
+    Unlike NickColourizer, which hands out colours in the order nicknames
+    appear, this picks a colour from a fixed palette by hashing the nickname,
+    so the same nick gets the same colour in every log file, search result
+    and server process.  It keeps no per-file state, and one instance can be
+    shared by any number of files.
+    """
+
+    # How many nicks __getitem__() remembers the colours of.  One instance
+    # can live as long as a server process, so this must be bounded.
+    CACHE_SIZE = 1024
+
+    def __init__(self, palette_size=64, colour_chooser=None):
+        """Create a colour chooser for nicknames.
+
+        The palette of `palette_size` colours is computed once, by asking the
+        colour chooser (default: ColourChooser()) for that many colours.
+        """
+        if colour_chooser is None:
+            colour_chooser = ColourChooser()
+        self.colour_chooser = colour_chooser
+        self.palette = [colour_chooser.choose(i, palette_size)
+                        for i in range(1, palette_size + 1)]
+        self.nick_colour = {}
+
+    def __getitem__(self, nick):
+        colour = self.nick_colour.get(nick)
+        if not colour:
+            slot = zlib.crc32(nick.encode('UTF-8')) & 0xffffffff
+            colour = self.palette[slot % len(self.palette)]
+            if len(self.nick_colour) >= self.CACHE_SIZE:
+                self.nick_colour.clear()
+            self.nick_colour[nick] = colour
+        return colour
+
+    def change(self, oldnick, newnick):
+        # The colour depends only on the nick, so there's nothing to track.
+        pass
+
+
 #
 # HTML
 #
 
+CONTROL_CHARS = re.compile(r'[\x00-\x1f]')
+
 URL_REGEXP = re.compile(r'((http|https|ftp|gopher|news)://([.,]*([^ \'")>&.,]|&amp;))*)')
 
 
@@ -343,13 +1372,158 @@ def escape(s):
 
     """
     s = s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
-    return ''.join([c for c in s if ord(c) > 0x1F])
+    if CONTROL_CHARS.search(s):
+        s = CONTROL_CHARS.sub('', s)
+    return s
+
+
+def escape_text(text, spaces=True):
+    """Escape the text of a message and turn URLs into links.
+
+    This is ``createlinks(escape(text))``, followed by replacing double
+    spaces with ``&nbsp;&nbsp;`` unless `spaces` is False, but it skips the
+    steps that cannot change anything.
+
+        >>> print(escape_text('<mg>  see http://example.com/?a&b'))
+        &lt;mg&gt;&nbsp;&nbsp;see <a href="http://example.com/?a&amp;b" rel="nofollow">http://example.com/?a&amp;b</a>
+
+        >>> print(escape_text('a  b', spaces=False))
+        a  b
+
+    """
+    text = escape(text)
+    if '://' in text:
+        text = createlinks(text)
+    if spaces and '  ' in text:
+        text = text.replace('  ', '&nbsp;&nbsp;')
+    return text
 
 
 #
 # Output styles
 #
 
+class BlockWriter(object):
+    """Text output stream that encodes and writes in large blocks.
+
+    This is a faster replacement for a line-buffered io.TextIOWrapper:
+    text is collected in a list and encoded once per block.  Encoding errors
+    are handled with 'xmlcharrefreplace', but that slower path is only taken
+    for blocks that cannot be encoded strictly.
+
+    Nothing is written until the block is full or you call flush().
+    """
+
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, outfile, encoding, block_size=None):
+        self.buffer = outfile
+        self.encoding = encoding
+        self.block_size = block_size or self.BLOCK_SIZE
+        self.pending = []
+        self.pending_size = 0
+
+    @property
+    def closed(self):
+        return self.buffer is None or self.buffer.closed
+
+    def write(self, text):
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            text = ''.join(self.pending)
+            if os.linesep != '\n':
+                text = text.replace('\n', os.linesep)
+            try:
+                data = text.encode(self.encoding)
+            except UnicodeError:
+                data = text.encode(self.encoding, 'xmlcharrefreplace')
+            self.pending = []
+            self.pending_size = 0
+            self.buffer.write(data)
+        self.buffer.flush()
+
+    def detach(self):
+        self.flush()
+        buffer, self.buffer = self.buffer, None
+        return buffer
+
+
+class RowTemplate(object):
+    """A row template compiled into a function.
+
+    `template` uses the str.format() syntax with named fields only, e.g.
+    ``'<p id="{anchor}">{text}</p>'``.  Calling the template with the field
+    values as keyword arguments (or positional arguments in the order the
+    fields first appear) returns the same as ``template.format(...)``, but
+    the template is parsed only once, here, and not on every call.
+
+    Styles declare their row layouts as RowTemplate class attributes;
+    ``self.some_row(...)`` then calls the compiled function directly.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        parts = []
+        fields = []
+        for literal, field, spec, conversion in string.Formatter().parse(
+                template):
+            parts.append(literal.replace('%', '%%'))
+            if field is None:
+                continue
+            if (spec or conversion or not re.match(r'^[A-Za-z_]\w*$', field)
+                    or keyword.iskeyword(field)):
+                raise ValueError('unsupported template field: {%s}' % field)
+            parts.append('%s')
+            fields.append(field)
+        self.fields = []
+        for field in fields:
+            if field not in self.fields:
+                self.fields.append(field)
+        source = 'def render(%s):\n    return %r %% (%s)\n' % (
+            ', '.join(self.fields), ''.join(parts),
+            ''.join(field + ', ' for field in fields))
+        namespace = {}
+        exec(source, namespace)
+        self.render = namespace['render']
+
+    def __call__(self, *args, **kw):
+        return self.render(*args, **kw)
+
+    def __get__(self, obj, cls=None):
+        return self.render
+
+    def __repr__(self):
+        return 'RowTemplate(%r)' % self.template
+
+
+class TimestampAnchors(object):
+    """Unique anchors for timestamps.
+
+    The first line with a given timestamp gets the anchor ``t12:00``, the
+    second one ``t12:00-2``, the third one ``t12:00-2-3``, and so on.  Only
+    the last anchor of every timestamp is remembered.
+    """
+
+    def __init__(self):
+        self.last = {}
+
+    def anchor(self, time):
+        last = self.last.get(time)
+        if last is None:
+            anchor, n = 't%s' % time, 1
+        else:
+            anchor, n = last
+            n += 1
+            anchor = '%s-%d' % (anchor, n)
+        self.last[time] = anchor, n
+        return anchor
+
+
 class AbstractStyle(object):
     """A style defines the way output is formatted.
 
@@ -360,8 +1534,9 @@ class AbstractStyle(object):
     name = "stylename"
     description = "Single-line description"
     charset = 'US-ASCII'
+    extension = '.html'
 
-    def __init__(self, outfile, colours=None):
+    def __init__(self, outfile, colours=None, buffered=False, anchors=None):
         """Create a text formatter for writing to outfile.
 
         The ``colours`` dictionary may have the following items:
@@ -372,12 +1547,24 @@ class AbstractStyle(object):
         - nickchange
         - action
 
+        Output is written line by line, unless you ask for it to be
+        ``buffered``, in which case you must call ``outfile.flush()`` when
+        you're done (convert_irc_log() does that).
+
+        Pass the ``anchors`` (a TimestampAnchors) of another formatter to
+        continue its timestamp anchors, e.g. on the next page of a log.
         """
-        self.outfile = io.TextIOWrapper(outfile, encoding=self.charset,
-                                        errors='xmlcharrefreplace',
-                                        line_buffering=True)
+        if buffered:
+            self.outfile = BlockWriter(outfile, self.charset)
+        else:
+            self.outfile = io.TextIOWrapper(outfile, encoding=self.charset,
+                                            errors='xmlcharrefreplace',
+                                            line_buffering=True)
         self.colours = colours or {}
-        self._anchors = set()
+        if anchors is None:
+            anchors = TimestampAnchors()
+        self._anchors = anchors
+        self._nick_cells = {}
 
     def __del__(self):
         """Destructor to make sure we don't close outfile prematurely."""
@@ -412,15 +1599,35 @@ class AbstractStyle(object):
         `htmlcolour` is a string ('#rrggbb').
         """
 
+    # How many different (nick, colour) pairs nick_cell() remembers
+    NICK_CELL_CACHE_SIZE = 1024
+
+    def nick_cell(self, nick, htmlcolour):
+        """Return render_nick_cell(nick, htmlcolour), remembering the result.
+
+        A nick usually speaks many times in the same colour, so this saves
+        escaping and formatting it for every line.  The colour is part of
+        the key, so a nick that changes colour is rendered again.
+        """
+        key = (nick, htmlcolour)
+        try:
+            return self._nick_cells[key]
+        except KeyError:
+            pass
+        if len(self._nick_cells) >= self.NICK_CELL_CACHE_SIZE:
+            self._nick_cells.clear()
+        cell = self._nick_cells[key] = self.render_nick_cell(nick, htmlcolour)
+        return cell
+
+    def render_nick_cell(self, nick, htmlcolour):
+        """Render the parts of a row that depend only on the nick.
+
+        Styles that call nick_cell() must define this.
+        """
+        raise NotImplementedError
+
     def timestamp_anchor(self, time):
-        anchor = 't%s' % time
-        if anchor in self._anchors:
-            for n in itertools.count(2):
-                anchor = '%s-%d' % (anchor, n)
-                if anchor not in self._anchors:
-                    break
-        self._anchors.add(anchor)
-        return anchor
+        return self._anchors.anchor(time)
 
 
 class SimpleTextStyle(AbstractStyle):
@@ -454,8 +1661,7 @@ class SimpleTextStyle(AbstractStyle):
 </tt></body></html>""" % {'VERSION': VERSION, 'RELEASE': RELEASE}, end=' ', file=self.outfile)
 
     def servermsg(self, time, what, text):
-        text = escape(text)
-        text = createlinks(text)
+        text = escape_text(text, spaces=False)
         colour = self.colours.get(what)
         if colour:
             text = '<font color="%s">%s</font>' % (colour, text)
@@ -466,9 +1672,7 @@ class SimpleTextStyle(AbstractStyle):
 
     def nicktext(self, time, nick, text, htmlcolour):
         nick = escape(nick)
-        text = escape(text)
-        text = createlinks(text)
-        text = text.replace('  ', '&nbsp;&nbsp;')
+        text = escape_text(text)
         self._nicktext(time, nick, text, htmlcolour)
 
     def _nicktext(self, time, nick, text, htmlcolour):
@@ -543,6 +1747,101 @@ class XHTMLStyle(AbstractStyle):
     prefix = '<div class="irclog">'
     suffix = '</div>'
 
+    # CSS rules for a nick colour class (see use_nick_palette)
+    NICK_CSS = ['span.{cls} {{ color: {color} }}']
+
+    servermsg_row = RowTemplate(
+        '<p id="{anchor}" class="{css_class}">'
+        '<a href="#{anchor}" class="time">{time}</a>'
+        ' {text}</p>')
+    servermsg_row_untimed = RowTemplate(
+        '<p class="{css_class}">{text}</p>')
+    nick_cell_row = RowTemplate(
+        '<span {nick_attrs}>&lt;{nick}&gt;</span>')
+    nicktext_row = RowTemplate(
+        '<p id="{anchor}" class="comment">'
+        '<a href="#{anchor}" class="time">{time}</a> '
+        '{nick_cell}'
+        ' <span class="text">{text}</span></p>')
+    nicktext_row_untimed = RowTemplate(
+        '<p class="comment">'
+        '{nick_cell}'
+        ' <span class="text">{text}</span></p>')
+
+    PAGE_SCRIPT = """\
+<script type="text/javascript">
+//<![CDATA[
+(function () {
+  var id = decodeURIComponent(location.hash.slice(1));
+  if (!id || document.getElementById(id)) return;
+  var xhr = new XMLHttpRequest();
+  xhr.onload = function () {
+    var n = JSON.parse(xhr.responseText)[id];
+    if (n === undefined) return;
+    var page = Math.floor(n / %(page_size)d) + 1;
+    var url = page == 1 ? %(first_url)s
+                        : %(url_pattern)s.replace('{page}', page);
+    location.replace(url + location.hash);
+  };
+  xhr.open('GET', %(index_url)s);
+  xhr.send();
+})();
+//]]>
+</script>
+"""
+
+    nick_classes = None
+    page_script = ''
+
+    def use_page_index(self, index_url, page_size, first_url, url_pattern):
+        """Follow permalinks to rows that are on other pages.
+
+        Adds a script to the page that looks up the anchor of a permalink
+        that's not on this page in the anchor index at `index_url` and goes
+        to the right page.  Page 1 is at `first_url`, page N at
+        ``url_pattern.replace('{page}', N)``.
+        """
+        def js(url):
+            return json.dumps(quote(url)).replace('</', '<\\/')
+        self.page_script = self.PAGE_SCRIPT % {
+            'page_size': page_size,
+            'first_url': js(first_url),
+            'url_pattern': js(url_pattern).replace('%7Bpage%7D', '{page}'),
+            'index_url': js(index_url),
+        }
+
+    def use_nick_palette(self, palette):
+        """Refer to the colours of `palette` by CSS class names.
+
+        Nicks whose colour is in the palette get a short class name instead
+        of an inline style attribute, and head() defines the classes in a
+        <style> block.  Other colours are still written inline.
+
+        Call this before head().
+        """
+        self.nick_classes = {}
+        for n, colour in enumerate(palette):
+            self.nick_classes.setdefault(colour, 'nc%d' % n)
+        self._nick_cells.clear()
+
+    def nick_style(self):
+        """Return the <style> block for nick colour classes, if any."""
+        if not self.nick_classes:
+            return ''
+        classes = sorted(self.nick_classes.items(),
+                         key=lambda item: int(item[1][2:]))
+        rules = ['    %s\n' % rule.format(cls=cls, color=colour)
+                 for colour, cls in classes
+                 for rule in self.NICK_CSS]
+        return ('  <style type="text/css">\n%s  </style>\n'
+                % ''.join(rules))
+
+    def nick_class(self, htmlcolour):
+        """Return the CSS class name for a nick colour, or None."""
+        if self.nick_classes is None:
+            return None
+        return self.nick_classes.get(htmlcolour)
+
     def head(self, title, prev=('', ''), index=('', ''), next=('', ''),
              searchbox=False):
         self.prev = prev
@@ -558,9 +1857,10 @@ class XHTMLStyle(AbstractStyle):
   <link rel="stylesheet" href="irclog.css" />
   <meta name="generator" content="irclog2html.py %(VERSION)s by Marius Gedminas" />
   <meta name="version" content="%(VERSION)s - %(RELEASE)s" />
-</head>
+%(nick_style)s</head>
 <body>""" % {'VERSION': VERSION, 'RELEASE': RELEASE,
-             'title': escape(title), 'charset': self.charset}, file=self.outfile)
+             'title': escape(title), 'charset': self.charset,
+             'nick_style': self.nick_style()}, file=self.outfile)
         self.heading(title)
         if searchbox:
             self.searchbox()
@@ -611,8 +1911,9 @@ class XHTMLStyle(AbstractStyle):
 <p>Generated by irclog2html.py %(VERSION)s by <a href="mailto:marius@pov.lt">Marius Gedminas</a>
  - find it at <a href="http://mg.pov.lt/irclog2html/">mg.pov.lt</a>!</p>
 </div>
-</body>
-</html>""" % {'VERSION': VERSION, 'RELEASE': RELEASE}, file=self.outfile)
+%(page_script)s</body>
+</html>""" % {'VERSION': VERSION, 'RELEASE': RELEASE,
+              'page_script': self.page_script}, file=self.outfile)
 
     def servermsg(self, time, what, text):
         """Output a generic server message.
@@ -621,23 +1922,17 @@ class XHTMLStyle(AbstractStyle):
         `line` is not escaped.
         `what` is one of LogParser event constants (e.g. LogParser.JOIN).
         """
-        text = escape(text)
-        text = createlinks(text)
+        text = escape_text(text, spaces=False)
         if time:
-            print(
-                '<p id="{anchor}" class="{css_class}">'
-                '<a href="#{anchor}" class="time">{time}</a>'
-                ' {text}</p>'.format(
-                    anchor=self.timestamp_anchor(time),
-                    css_class=self.CLASSMAP[what],
-                    time=shorttime(time),
-                    text=text),
-                file=self.outfile)
+            print(self.servermsg_row(anchor=self.timestamp_anchor(time),
+                                     css_class=self.CLASSMAP[what],
+                                     time=shorttime(time),
+                                     text=text),
+                  file=self.outfile)
         else:
-            print(
-                '<p class="{css_class}">{text}</p>'.format(
-                    css_class=self.CLASSMAP[what], text=text),
-                file=self.outfile)
+            print(self.servermsg_row_untimed(css_class=self.CLASSMAP[what],
+                                             text=text),
+                  file=self.outfile)
 
     def nicktext(self, time, nick, text, htmlcolour):
         """Output a comment uttered by someone.
@@ -646,33 +1941,25 @@ class XHTMLStyle(AbstractStyle):
         `nick` and `text` are not escaped.
         `htmlcolour` is a string ('#rrggbb').
         """
-        nick = escape(nick)
-        text = escape(text)
-        text = createlinks(text)
-        text = text.replace('  ', '&nbsp;&nbsp;')
+        text = escape_text(text)
         if time:
-            print(
-                '<p id="{anchor}" class="comment">'
-                '<a href="#{anchor}" class="time">{time}</a> '
-                '<span class="nick" style="color: {color}">'
-                '&lt;{nick}&gt;</span>'
-                ' <span class="text">{text}</span></p>'.format(
-                    anchor=self.timestamp_anchor(time),
-                    time=shorttime(time),
-                    color=htmlcolour,
-                    nick=nick,
-                    text=text),
-                file=self.outfile)
+            print(self.nicktext_row(anchor=self.timestamp_anchor(time),
+                                    time=shorttime(time),
+                                    nick_cell=self.nick_cell(nick, htmlcolour),
+                                    text=text),
+                  file=self.outfile)
         else:
-            print(
-                '<p class="comment">'
-                '<span class="nick" style="color: {color}">'
-                '&lt;{nick}&gt;</span>'
-                ' <span class="text">{text}</span></p>'.format(
-                    color=htmlcolour,
-                    nick=nick,
-                    text=text),
-                file=self.outfile)
+            nick_cell = self.nick_cell(nick, htmlcolour)
+            print(self.nicktext_row_untimed(nick_cell=nick_cell, text=text),
+                  file=self.outfile)
+
+    def render_nick_cell(self, nick, htmlcolour):
+        cls = self.nick_class(htmlcolour)
+        if cls:
+            nick_attrs = 'class="nick %s"' % cls
+        else:
+            nick_attrs = 'class="nick" style="color: %s"' % htmlcolour
+        return self.nick_cell_row(nick_attrs=nick_attrs, nick=escape(nick))
 
 
 class XHTMLTableStyle(XHTMLStyle):
@@ -684,60 +1971,78 @@ class XHTMLTableStyle(XHTMLStyle):
     prefix = '<table class="irclog">'
     suffix = '</table>'
 
+    NICK_CSS = ['th.{cls} {{ background: {color} }}',
+                'td.{cls} {{ color: {color} }}']
+
+    servermsg_row = RowTemplate(
+        '<tr id="{anchor}">'
+        '<td class="{css_class}" colspan="2">{text}</td>'
+        '<td><a href="{link}#{anchor}" class="time">{time}</a></td>'
+        '</tr>')
+    servermsg_row_untimed = RowTemplate(
+        '<tr>'
+        '<td class="{css_class}" colspan="3">{text}</td>'
+        '</tr>')
+    nick_cell_row = RowTemplate(
+        '<th {nick_attrs}>{nick}</th>')
+    nicktext_row = RowTemplate(
+        '<tr id="{anchor}">'
+        '{nick_cell}'
+        '<td class="{text_class}"{text_style}>{text}</td>'
+        '<td class="time">'
+        '<a href="{link}#{anchor}" class="time">{time}</a></td>'
+        '</tr>')
+    nicktext_row_untimed = RowTemplate(
+        '<tr>'
+        '{nick_cell}'
+        '<td class="{text_class}" colspan="2"{text_style}>{text}</td>'
+        '</tr>')
+
     def servermsg(self, time, what, text, link=''):
-        text = escape(text)
-        text = createlinks(text)
+        text = escape_text(text, spaces=False)
         if time:
-            print(
-                '<tr id="{anchor}">'
-                '<td class="{css_class}" colspan="2">{text}</td>'
-                '<td><a href="{link}#{anchor}" class="time">{time}</a></td>'
-                '</tr>'.format(
-                    anchor=self.timestamp_anchor(time),
-                    css_class=self.CLASSMAP[what],
-                    text=text,
-                    link=link,
-                    time=shorttime(time)),
-                file=self.outfile)
+            print(self.servermsg_row(anchor=self.timestamp_anchor(time),
+                                     css_class=self.CLASSMAP[what],
+                                     text=text,
+                                     link=link,
+                                     time=shorttime(time)),
+                  file=self.outfile)
         else:
-            print(
-                '<tr>'
-                '<td class="{css_class}" colspan="3">{text}</td>'
-                '</tr>'.format(
-                    css_class=self.CLASSMAP[what],
-                    text=text),
-                file=self.outfile)
+            print(self.servermsg_row_untimed(css_class=self.CLASSMAP[what],
+                                             text=text),
+                  file=self.outfile)
 
     def nicktext(self, time, nick, text, htmlcolour, link=''):
-        nick = escape(nick)
-        text = escape(text)
-        text = createlinks(text)
-        text = text.replace('  ', '&nbsp;&nbsp;')
+        text = escape_text(text)
+        nick_cell, text_class, text_style = self.nick_cell(nick, htmlcolour)
         if time:
-            print(
-                '<tr id="{anchor}">'
-                '<th class="nick" style="background: {color}">{nick}</th>'
-                '<td class="text" style="color: {color}">{text}</td>'
-                '<td class="time">'
-                '<a href="{link}#{anchor}" class="time">{time}</a></td>'
-                '</tr>'.format(
-                    anchor=self.timestamp_anchor(time),
-                    color=htmlcolour,
-                    nick=nick,
-                    text=text,
-                    link=link,
-                    time=shorttime(time)),
-                file=self.outfile)
+            print(self.nicktext_row(anchor=self.timestamp_anchor(time),
+                                    nick_cell=nick_cell,
+                                    text_class=text_class,
+                                    text_style=text_style,
+                                    text=text,
+                                    link=link,
+                                    time=shorttime(time)),
+                  file=self.outfile)
+        else:
+            print(self.nicktext_row_untimed(nick_cell=nick_cell,
+                                            text_class=text_class,
+                                            text_style=text_style,
+                                            text=text),
+                  file=self.outfile)
+
+    def render_nick_cell(self, nick, htmlcolour):
+        cls = self.nick_class(htmlcolour)
+        if cls:
+            nick_attrs = 'class="nick %s"' % cls
+            text_class = 'text %s' % cls
+            text_style = ''
         else:
-            print(
-                '<tr>'
-                '<th class="nick" style="background: {color}">{nick}</th>'
-                '<td class="text" colspan="2" style="color: {color}">{text}</td>'
-                '</tr>'.format(
-                    color=htmlcolour,
-                    nick=nick,
-                    text=text),
-                file=self.outfile)
+            nick_attrs = 'class="nick" style="background: %s"' % htmlcolour
+            text_class = 'text'
+            text_style = ' style="color: %s"' % htmlcolour
+        return (self.nick_cell_row(nick_attrs=nick_attrs, nick=escape(nick)),
+                text_class, text_style)
 
 
 class MediaWikiStyle(AbstractStyle):
@@ -745,6 +2050,24 @@ class MediaWikiStyle(AbstractStyle):
 
     name = 'mediawiki'
     description = __doc__
+    extension = '.wiki'
+
+    servermsg_row = RowTemplate(
+        '|- id="t{time}"\n'
+        '| colspan="2" | {text}\n'
+        '|| [[#t{time}|{displaytime}]]')
+    servermsg_row_untimed = RowTemplate(
+        '|-\n'
+        '| colspan="3" | {text}')
+    nicktext_row = RowTemplate(
+        '|- id="t{time}"\n'
+        '! style="background-color: {color}" | {nick}\n'
+        '| style="color: {color}" | {text}\n'
+        '|| [[#t{time}|{displaytime}]] ')
+    nicktext_row_untimed = RowTemplate(
+        '|-\n'
+        '| style="background-color: {color}" | {nick}\n'
+        '| style="color: {color}" colspan="2" | {text} ')
 
     def head(self, title, prev=('', ''), index=('', ''), next=('', ''),
              searchbox=False):
@@ -754,32 +2077,24 @@ class MediaWikiStyle(AbstractStyle):
         text = escape(text)
         # no need to call createlinks, MediaWiki parses links automatically
         if time:
-            displaytime = shorttime(time)
-            print('|- id="t%s"\n'
-                  '| colspan="2" | %s\n'
-                  '|| [[#t%s|%s]]'
-                  % (time, text, time, displaytime), file=self.outfile)
+            print(self.servermsg_row(time=time, text=text,
+                                     displaytime=shorttime(time)),
+                  file=self.outfile)
         else:
-            print('|-\n'
-                  '| colspan="3" | %s' % text, file=self.outfile)
+            print(self.servermsg_row_untimed(text=text), file=self.outfile)
 
     def nicktext(self, time, nick, text, htmlcolour, link=''):
         nick = escape(nick)
         text = escape(text)
         # no need to call createlinks, MediaWiki parses links automatically
         if time:
-            displaytime = shorttime(time)
-            print('|- id="t%s"\n'
-                  '! style="background-color: %s" | %s\n'
-                  '| style="color: %s" | %s\n'
-                  '|| [[#t%s|%s]] '
-                  % (time, htmlcolour, nick, htmlcolour, text,
-                     time, displaytime), file=self.outfile)
+            print(self.nicktext_row(time=time, color=htmlcolour, nick=nick,
+                                    text=text, displaytime=shorttime(time)),
+                  file=self.outfile)
         else:
-            print('|-\n'
-                  '| style="background-color: %s" | %s\n'
-                  '| style="color: %s" colspan="2" | %s '
-                  % (htmlcolour, nick, htmlcolour, text), file=self.outfile)
+            print(self.nicktext_row_untimed(color=htmlcolour, nick=nick,
+                                            text=text),
+                  file=self.outfile)
 
     def foot(self):
         print('|}\n\nGenerated by irclog2html.py %(VERSION)s '
@@ -789,6 +2104,93 @@ class MediaWikiStyle(AbstractStyle):
               % {'VERSION': VERSION}, file=self.outfile)
 
 
+def json_string(s):
+    """Encode a string, or None, as JSON.
+
+        >>> print(json_string('say "hi"'))
+        "say \\"hi\\""
+        >>> print(json_string(None))
+        null
+
+    """
+    if s is None:
+        return 'null'
+    return encode_basestring(s)
+
+
+class NDJSONStyle(AbstractStyle):
+    """Newline-delimited JSON, one object per event"""
+
+    name = 'ndjson'
+    description = __doc__
+    charset = 'UTF-8'
+    extension = '.ndjson'
+
+    # Keys in sorted order, like json.dumps(..., sort_keys=True) would write
+    # them; formatting the values ourselves is several times faster
+    event_row = RowTemplate(
+        '{{"anchor": {anchor}, "colour": {colour}, "nick": {nick},'
+        ' "text": {text}, "time": {time}, "type": "{type}"}}')
+
+    def servermsg(self, time, what, text):
+        self.event(time, what, None, text, self.colours.get(what))
+
+    def nicktext(self, time, nick, text, htmlcolour):
+        self.event(time, LogParser.COMMENT, nick, text, htmlcolour)
+
+    def event(self, time, what, nick, text, colour):
+        """Output a JSON object describing an event.
+
+        The object has these keys:
+
+        - time: the timestamp in ISO 8601 (see isotime()), or null
+        - type: the name of a LogParser event constant (e.g. "COMMENT")
+        - nick: who said it (for comments), or null
+        - text: the text of the message
+        - anchor: the id the XHTML styles give to this line, or null
+        - colour: the colour of the nick or of the event, or null
+        """
+        if time:
+            anchor = encode_basestring(self.timestamp_anchor(time))
+            time = encode_basestring(isotime(time))
+        else:
+            anchor = time = 'null'
+        print(self.event_row(anchor=anchor, colour=json_string(colour),
+                             nick=json_string(nick),
+                             text=encode_basestring(text), time=time,
+                             type=what.value),
+              file=self.outfile)
+
+
+class MultiStyle(object):
+    """Pass every event to several formatters.
+
+    convert_irc_log() uses this when you give it a list of formatters, so
+    that one parse of a log can be rendered in several styles.
+    """
+
+    def __init__(self, formatters):
+        self.formatters = list(formatters)
+        self._servermsg = [f.servermsg for f in self.formatters]
+        self._nicktext = [f.nicktext for f in self.formatters]
+
+    def head(self, *args, **kw):
+        for formatter in self.formatters:
+            formatter.head(*args, **kw)
+
+    def foot(self):
+        for formatter in self.formatters:
+            formatter.foot()
+
+    def servermsg(self, time, what, text):
+        for servermsg in self._servermsg:
+            servermsg(time, what, text)
+
+    def nicktext(self, time, nick, text, htmlcolour):
+        for nicktext in self._nicktext:
+            nicktext(time, nick, text, htmlcolour)
+
+
 #
 # Main
 #
@@ -802,6 +2204,7 @@ STYLES = [
     XHTMLStyle,
     XHTMLTableStyle,
     MediaWikiStyle,
+    NDJSONStyle,
 ]
 
 # Customizable colours
@@ -847,7 +2250,12 @@ def parse_args(argv=sys.argv):
     parser.add_option('-s', '--style', dest="style", default="xhtmltable",
                       help="format log according to specific style"
                            " (default: xhtmltable); try -s help for a list of"
-                           " available styles")
+                           " available styles.  Give several comma-separated"
+                           " styles to convert each log to all of them:"
+                           " the first one is written to the output file,"
+                           " the others next to it, e.g. -s"
+                           " xhtmltable,ndjson writes <input-file-name>.html"
+                           " and <input-file-name>.ndjson")
     parser.add_option('-t', '--title', dest="title", default=None,
                       help="title of the page (default: same as file name)")
     parser.add_option('--prev-title', dest="prev_title", default='',
@@ -868,6 +2276,43 @@ def parse_args(argv=sys.argv):
     parser.add_option('-o', '--output-file',
                       help="destination output file or directory"
                            " (default: <input-file-name>.html)")
+    parser.add_option('--cache-dir', metavar='DIR',
+                      default=os.environ.get('IRCLOG_CACHE_DIR'),
+                      help="keep parsed log files in DIR and skip parsing"
+                           " unchanged files (default: $IRCLOG_CACHE_DIR,"
+                           " if set)")
+    parser.add_option('--parse-jobs', metavar='N', type='int', default=1,
+                      help="parse large log files in N processes"
+                           " (default: 1; ignored with --cache-dir"
+                           " and --jobs)")
+    parser.add_option('-j', '--jobs', metavar='N', type='int', default=1,
+                      help="convert N files at a time in separate processes"
+                           " (default: 1); errors are reported for every"
+                           " file instead of stopping at the first one")
+    parser.add_option('--files-from', metavar='FILE',
+                      help="also convert the files listed in FILE, one per"
+                           " line (use - for standard input)")
+    parser.add_option('-0', '--null', action='store_true', default=False,
+                      help="file names in --files-from are separated by NUL"
+                           " characters instead of newlines (e.g. find"
+                           " -print0)")
+    parser.add_option('--stable-colors', '--stable-colours',
+                      action='store_true', dest='stable_colours',
+                      default=False,
+                      help="pick nick colours by hashing the nick, so that"
+                           " every nick keeps its colour across log files")
+    parser.add_option('--nick-classes', action='store_true', default=False,
+                      help="refer to nick colours by CSS classes defined"
+                           " once in the page header instead of repeating"
+                           " them on every line (xhtml and xhtmltable"
+                           " styles; implies --stable-colours)")
+    parser.add_option('--anchor-index', action='store_true', default=False,
+                      help="also write the event number of every timestamp"
+                           " anchor to <output-file-name>.anchors.json")
+    parser.add_option('--page-size', metavar='N', type='int', default=0,
+                      help="split the output into pages of N lines"
+                           " (<output-file-name>.html, <output-file-name>"
+                           ".p2.html, ...; default: one page)")
     for name, default, what in COLOURS:
         parser.add_option('--color-%s' % name, '--colour-%s' % name,
                           dest="colour_%s" % name, default=default,
@@ -879,12 +2324,364 @@ def parse_args(argv=sys.argv):
 
 def pick_output_filename(input_filename):
     """Pick a filename for the output file."""
-    if input_filename.endswith('.gz'):
-        return input_filename[:-len('.gz')] + ".html"
+    extension = compression_extension(input_filename)
+    if extension:
+        return input_filename[:-len(extension)] + ".html"
     else:
         return input_filename + ".html"
 
 
+def pick_page_filename(output_filename, page):
+    """Pick a filename for a page of the output file.
+
+    Page 1 goes to the output file itself.
+    """
+    if page == 1:
+        return output_filename
+    root, ext = os.path.splitext(output_filename)
+    return '%s.p%s%s' % (root, page, ext)
+
+
+def pick_style_filename(output_filename, style):
+    """Pick a filename for the output of an additional style.
+
+    It goes next to the output file, with the extension of the style, or
+    with the name of the style added if that extension is already taken.
+    """
+    root, ext = os.path.splitext(output_filename)
+    if style.extension == ext:
+        return '%s.%s%s' % (root, style.name, ext)
+    return root + style.extension
+
+
+def pick_anchor_index_filename(output_filename):
+    """Pick a filename for the anchor index of an output file."""
+    return os.path.splitext(output_filename)[0] + '.anchors.json'
+
+
+class Error(Exception):
+    """Conversion error."""
+
+
+def find_style(name):
+    """Find a style class by name.
+
+    Returns None if there's no such style in STYLES.
+    """
+    for style in STYLES:
+        if style.name == name:
+            return style
+    return None
+
+
+class LogConverter(object):
+    """Convert log files according to irclog2html's command-line options.
+
+    The styles, colours, parse cache and nick colourizer are set up once,
+    here, so you can convert any number of files with the same converter.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.styles = []
+        for name in options.style.split(','):
+            style = find_style(name)
+            if style is None:
+                raise Error("unknown style: %s" % name)
+            self.styles.append(style)
+        self.colours = {}
+        for name, default, what in COLOURS:
+            self.colours[what] = getattr(options, 'colour_%s' % name)
+        self.prev = (options.prev_title, options.prev_url)
+        self.index = (options.index_title, options.index_url)
+        self.next = (options.next_title, options.next_url)
+        if options.cache_dir:
+            self.cache = ParseCache(options.cache_dir)
+        else:
+            self.cache = None
+        if options.stable_colours or options.nick_classes:
+            self.nick_colour = HashNickColourizer()
+        else:
+            self.nick_colour = None
+        # Directories that already have a stylesheet
+        self.css_dirs = set()
+
+    def make_formatter(self, outfile, anchors=None, style=None):
+        """Create a formatter that writes to outfile.
+
+        Uses the first style, unless you ask for another one.
+        """
+        if style is None:
+            style = self.styles[0]
+        formatter = style(outfile, self.colours, buffered=True,
+                          anchors=anchors)
+        if (self.options.nick_classes
+                and hasattr(formatter, 'use_nick_palette')):
+            formatter.use_nick_palette(self.nick_colour.palette)
+        return formatter
+
+    def parse(self, filename):
+        """Parse a log file.
+
+        Returns an iterable of events, and a file that must be closed
+        after iterating (or None).
+        """
+        options = self.options
+        infile = None
+        try:
+            if self.cache is not None:
+                logparser = self.cache.parse(filename,
+                                             dircproxy=options.dircproxy,
+                                             use_mmap=True)
+            elif options.parse_jobs > 1:
+                logparser = parse_log_file_in_parallel(
+                    filename, options.parse_jobs, dircproxy=options.dircproxy)
+            else:
+                infile = open_log_file(filename, use_mmap=True)
+                logparser = LogParser(infile, dircproxy=options.dircproxy)
+        except EnvironmentError as e:
+            raise Error("cannot open %s for reading: %s" % (filename, e))
+        except EOFError as e:
+            # a truncated compressed file
+            raise Error("cannot read %s: %s" % (filename, e))
+        return logparser, infile
+
+    def output_filename(self, filename):
+        """Pick the name of the output file for a log file."""
+        output_file = self.options.output_file
+        if not output_file:
+            return pick_output_filename(filename)
+        elif os.path.isdir(output_file):
+            return os.path.join(output_file,
+                                os.path.basename(pick_output_filename(filename)))
+        else:
+            return output_file
+
+    def copy_css(self, directory):
+        """Copy the stylesheet to a directory, unless it's already there."""
+        if directory in self.css_dirs:
+            return
+        css_file = os.path.join(directory, 'irclog.css')
+        if not os.path.exists(css_file) and os.path.exists(CSS_FILE):
+            shutil.copy(CSS_FILE, css_file)
+        self.css_dirs.add(directory)
+
+    def output_files(self, filename):
+        """List the output files of a log file that have navigation bars.
+
+        Returns a list of (style, filenames), where filenames are the pages
+        of the output (just one unless the log was split into pages).
+        """
+        outfilename = self.output_filename(filename)
+        files = []
+        for n, style in enumerate(self.styles):
+            if not hasattr(style, 'navbar'):
+                continue
+            if n > 0:
+                files.append((style, [pick_style_filename(outfilename,
+                                                          style)]))
+                continue
+            pages = [outfilename]
+            if self.options.page_size:
+                while os.path.exists(pick_page_filename(outfilename,
+                                                        len(pages) + 1)):
+                    pages.append(pick_page_filename(outfilename,
+                                                    len(pages) + 1))
+            files.append((style, pages))
+        return files
+
+    def render_navbar(self, style, prev, next):
+        """Render the navigation bar of a page, as it's written to files."""
+        f = io.BytesIO()
+        formatter = style(f, self.colours, buffered=True)
+        formatter.navbar(prev, self.index, next)
+        formatter.outfile.flush()
+        return f.getvalue()
+
+    def patch_navigation(self, filename, old_prev, old_next, prev, next):
+        """Change the links to the previous and next log in converted files.
+
+        Replaces the navigation bars in the output files of `filename`
+        that were converted with `old_prev` and `old_next`, without parsing
+        the log again.  The files are replaced atomically.
+
+        Returns False, and changes nothing, if the output files don't have
+        the navigation bars they should have; then the log has to be
+        converted again.
+        """
+        patched = []
+        for style, pages in self.output_files(filename):
+            urls = [os.path.basename(page) for page in pages]
+            for n, page in enumerate(pages, 1):
+                old = self.render_navbar(
+                    style, *page_navigation(n, urls, old_prev, old_next))
+                new = self.render_navbar(
+                    style, *page_navigation(n, urls, prev, next))
+                if old == new:
+                    continue
+                try:
+                    with io.open(page, 'rb') as f:
+                        data = f.read()
+                except EnvironmentError:
+                    return False
+                # once in the header and once in the footer
+                if not old or data.count(old) != 2:
+                    return False
+                patched.append((page, data.replace(old, new)))
+        for page, data in patched:
+            try:
+                replace_file(page, data)
+            except EnvironmentError:
+                return False
+        return True
+
+    def convert(self, filename, title=None, prev=None, next=None):
+        """Convert a log file.
+
+        `title`, `prev` and `next` override the title and the navigation
+        links given in the options.
+        """
+        options = self.options
+        styles = self.styles
+        title = title or options.title or filename
+        if prev is None:
+            prev = self.prev
+        if next is None:
+            next = self.next
+        logparser, infile = self.parse(filename)
+        # Why open the output file in binary mode?  We currently handle
+        # encoding in our style classes, and they have different default
+        # charsets, so it's simpler to just give a binary file to the
+        # style class and let it deal with all the details.
+        outfilename = self.output_filename(filename)
+        outfiles = []
+        try:
+            for fn in [outfilename] + [pick_style_filename(outfilename, style)
+                                       for style in styles[1:]]:
+                outfiles.append(io.open(fn, "wb"))
+        except EnvironmentError as e:
+            for outfile in outfiles:
+                outfile.close()
+            if infile is not None:
+                infile.close()
+            raise Error("cannot open %s for writing: %s" % (fn, e))
+        outfile = outfiles[0]
+        try:
+            formatters = [self.make_formatter(f, style=style)
+                          for f, style in zip(outfiles[1:], styles[1:])]
+            pages = 1
+            if ((options.anchor_index or options.page_size)
+                    and not isinstance(logparser, ParsedLog)):
+                log = ParsedLog()
+                log.extend(logparser)
+                logparser = log
+            if options.page_size:
+                pages = convert_irc_log_pages(
+                    logparser, options.page_size, self.make_formatter,
+                    outfile, outfilename, title, prev, self.index, next,
+                    searchbox=options.searchbox,
+                    nick_colour=self.nick_colour)
+            else:
+                formatters.insert(0, self.make_formatter(outfile))
+            if formatters:
+                convert_irc_log(logparser, formatters, title, prev,
+                                self.index, next,
+                                searchbox=options.searchbox,
+                                nick_colour=self.nick_colour)
+            if options.anchor_index or pages > 1:
+                write_anchor_index(anchor_index(logparser),
+                                   pick_anchor_index_filename(outfilename))
+            self.copy_css(os.path.dirname(outfilename))
+        except EOFError as e:
+            raise Error("cannot read %s: %s" % (filename, e))
+        finally:
+            for outfile in outfiles:
+                outfile.close()
+            if infile is not None:
+                infile.close()
+
+
+def replace_file(filename, data):
+    """Replace the contents of a file atomically, keeping its permissions."""
+    mode = stat.S_IMODE(os.stat(filename).st_mode)
+    fd, tmpname = tempfile.mkstemp(prefix='.', suffix='.tmp',
+                                   dir=os.path.dirname(filename) or '.')
+    try:
+        with io.open(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmpname, mode)
+        # os.rename() can't overwrite files on Windows; os.replace()
+        # is Python 3.3+
+        getattr(os, 'replace', os.rename)(tmpname, filename)
+    except EnvironmentError:
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+        raise
+
+
+def read_file_list(f, null=False):
+    """Read a list of file names, one per line or separated by NUL bytes."""
+    data = f.read()
+    if null:
+        # sys.stdin gives us bytes on Python 2
+        names = data.split('\0' if isinstance(data, unicode) else b'\0')
+    else:
+        names = data.splitlines()
+    return [name for name in names if name]
+
+
+# The converter of a worker process of convert_log_files_in_parallel()
+_worker_converter = None
+
+
+def init_conversion_worker(options):
+    global _worker_converter
+    _worker_converter = LogConverter(options)
+
+
+def convert_log_file_in_worker(filename):
+    """Convert a log file in a worker process.
+
+    Returns (filename, None), or (filename, error message) if it failed.
+    """
+    try:
+        _worker_converter.convert(filename)
+    except Error as e:
+        return filename, str(e)
+    except Exception as e:
+        return filename, "cannot convert %s: %s: %s" % (
+            filename, e.__class__.__name__, e)
+    return filename, None
+
+
+def convert_log_files_in_parallel(filenames, options, jobs,
+                                  max_files_per_worker=1000):
+    """Convert log files using several processes.
+
+    Every worker converts one file at a time, and is replaced by a fresh
+    process after ``max_files_per_worker`` files, so memory use stays
+    bounded no matter how many files there are.
+
+    Yields (filename, error message) for every file that couldn't be
+    converted, as soon as it fails.
+    """
+    # daemonic pool workers can't start pools of their own
+    options = optparse.Values(vars(options))
+    options.parse_jobs = 1
+    pool = multiprocessing.Pool(jobs, init_conversion_worker, (options, ),
+                                max_files_per_worker)
+    try:
+        for filename, error in pool.imap_unordered(
+                convert_log_file_in_worker, filenames):
+            if error is not None:
+                yield filename, error
+    finally:
+        pool.close()
+        pool.join()
+
+
 def main(argv=sys.argv):
     parser, options, args = parse_args(argv)
     if options.style == "help":
@@ -895,66 +2692,147 @@ def main(argv=sys.argv):
             print("    %s" % style.description)
         print()
         return
-    for style in STYLES:
-        if style.name == options.style:
-            break
-    else:
-        parser.error("unknown style: %s" % options.style)
-    colours = {}
-    for name, default, what in COLOURS:
-        colours[what] = getattr(options, 'colour_%s' % name)
-    if not args:
+    for name in options.style.split(','):
+        if find_style(name) is None:
+            parser.error("unknown style: %s" % name)
+    filenames = list(args)
+    if options.files_from:
+        try:
+            if options.files_from == '-':
+                filenames += read_file_list(sys.stdin, options.null)
+            else:
+                with io.open(options.files_from) as f:
+                    filenames += read_file_list(f, options.null)
+        except EnvironmentError as e:
+            sys.exit("%s: cannot read %s: %s"
+                     % (parser.prog, options.files_from, e))
+    if not filenames:
         parser.error("please specify a filename")
-    title = options.title
-    prev = (options.prev_title, options.prev_url)
-    index = (options.index_title, options.index_url)
-    next = (options.next_title, options.next_url)
 
-    if len(args) > 1 and options.output_file and not os.path.isdir(options.output_file):
+    if len(filenames) > 1 and options.output_file and not os.path.isdir(options.output_file):
         parser.error("-o must be a directory when processing multiple files")
-    for filename in args:
+
+    if options.jobs > 1 and len(filenames) > 1:
+        failed = 0
+        for filename, error in convert_log_files_in_parallel(
+                filenames, options, options.jobs):
+            print("%s: %s" % (parser.prog, error), file=sys.stderr)
+            failed += 1
+        if failed:
+            sys.exit("%s: %d of %d files could not be converted"
+                     % (parser.prog, failed, len(filenames)))
+        return
+
+    converter = LogConverter(options)
+    for filename in filenames:
         try:
-            infile = open_log_file(filename)
-        except EnvironmentError as e:
-            sys.exit("%s: cannot open %s for reading: %s"
-                     % (parser.prog, filename, e))
-        # Why open the output file in binary mode?  We currently handle
-        # encoding in our style classes, and they have different default
-        # charsets, so it's simpler to just give a binary file to the
-        # style class and let it deal with all the details.
-        if not options.output_file:
-            outfilename = pick_output_filename(filename)
-        elif os.path.isdir(options.output_file):
-            outfilename = os.path.join(
-                options.output_file,
-                os.path.basename(pick_output_filename(filename)))
+            converter.convert(filename)
+        except Error as e:
+            sys.exit("%s: %s" % (parser.prog, e))
+
+
+def convert_irc_log(parser, formatter, title, prev, index, next,
+                    searchbox=False, nick_colour=None):
+    """Convert IRC log to HTML or some other format.
+
+    `formatter` can also be a list of formatters, to convert the log to
+    several formats while parsing it only once.
+    """
+    if isinstance(formatter, (list, tuple)):
+        formatters = formatter
+        if len(formatters) > 1:
+            formatter = MultiStyle(formatters)
         else:
-            outfilename = options.output_file
-        try:
-            outfile = io.open(outfilename, "wb")
-        except EnvironmentError as e:
-            infile.close()
-            sys.exit("%s: cannot open %s for writing: %s"
-                     % (parser.prog, outfilename, e))
+            formatter = formatters[0]
+    else:
+        formatters = [formatter]
+    if nick_colour is None:
+        nick_colour = NickColourizer()
+    formatter.head(title, prev, index, next, searchbox=searchbox)
+    format_events(parser, formatter, nick_colour)
+    formatter.foot()
+    for formatter in formatters:
+        formatter.outfile.flush()
+
+
+def convert_irc_log_pages(log, page_size, make_formatter, outfile,
+                          outfilename, title, prev, index, next,
+                          searchbox=False, nick_colour=None):
+    """Convert a ParsedLog into pages of `page_size` events.
+
+    The first page is written to `outfile`, and the others to new files
+    named after `outfilename` (see pick_page_filename()); pages left over
+    from an earlier, longer conversion are removed.  Every page links to
+    the previous and the next one, and the timestamp anchors and nick
+    colours continue from one page to the next.
+
+    `make_formatter(outfile, anchors)` must return a formatter.
+
+    Returns the number of pages.
+    """
+    pages = max(1, (len(log) + page_size - 1) // page_size)
+    if nick_colour is None:
+        nick_colour = NickColourizer()
+    anchors = TimestampAnchors()
+    basename = os.path.basename(outfilename)
+    urls = [os.path.basename(pick_page_filename(outfilename, n))
+            for n in range(1, pages + 1)]
+    for n in range(1, pages + 1):
+        if n > 1:
+            outfile = io.open(pick_page_filename(outfilename, n), 'wb')
         try:
-            parser = LogParser(infile, dircproxy=options.dircproxy)
-            formatter = style(outfile, colours)
-            convert_irc_log(parser, formatter, title or filename,
-                            prev, index, next, searchbox=options.searchbox)
-            css_file = os.path.join(os.path.dirname(outfilename), 'irclog.css')
-            if not os.path.exists(css_file) and os.path.exists(CSS_FILE):
-                shutil.copy(CSS_FILE, css_file)
+            formatter = make_formatter(outfile, anchors)
+            if pages == 1:
+                page_title = title
+            else:
+                page_title = '%s (page %d of %d)' % (title, n, pages)
+                if hasattr(formatter, 'use_page_index'):
+                    formatter.use_page_index(
+                        os.path.basename(
+                            pick_anchor_index_filename(outfilename)),
+                        page_size, urls[0],
+                        pick_page_filename(basename, '{page}'))
+            page_prev, page_next = page_navigation(n, urls, prev, next)
+            events = itertools.islice(log.iter_from((n - 1) * page_size),
+                                      page_size)
+            convert_irc_log(events, formatter, page_title, page_prev, index,
+                            page_next, searchbox=searchbox,
+                            nick_colour=nick_colour)
         finally:
-            outfile.close()
-            infile.close()
+            if n > 1:
+                outfile.close()
+    n = pages + 1
+    while os.path.exists(pick_page_filename(outfilename, n)):
+        os.remove(pick_page_filename(outfilename, n))
+        n += 1
+    return pages
 
 
-def convert_irc_log(parser, formatter, title, prev, index, next,
-                    searchbox=False):
-    """Convert IRC log to HTML or some other format."""
-    nick_colour = NickColourizer()
-    formatter.head(title, prev, index, next, searchbox=searchbox)
-    for time, what, info in parser:
+def page_navigation(page, urls, prev, next):
+    """Pick the previous and next links for a page of a log.
+
+    `urls` are the URLs of all the pages, and `prev` and `next` the links
+    to the previous and the next log.
+    """
+    if page > 1:
+        page_prev = ('&#171; Page %d' % (page - 1), urls[page - 2])
+    else:
+        page_prev = prev
+    if page < len(urls):
+        page_next = ('Page %d &#187;' % (page + 1), urls[page])
+    else:
+        page_next = next
+    return page_prev, page_next
+
+
+def format_events(events, formatter, nick_colour):
+    """Format a sequence of events, without the header and the footer.
+
+    The formatter and the nick colourizer remember the anchors and nick
+    colours that were used, so you can call this again with the events that
+    follow and get the same result as if you'd formatted all of them at once.
+    """
+    for time, what, info in events:
         if what == LogParser.COMMENT:
             nick, text = info
             htmlcolour = nick_colour[nick]
@@ -966,7 +2844,23 @@ def convert_irc_log(parser, formatter, title, prev, index, next,
             else:
                 text = info
             formatter.servermsg(time, what, text)
-    formatter.foot()
+
+
+def anchor_index(events):
+    """Map the timestamp anchors of a log to event numbers.
+
+    These are the anchors that the XHTML styles give to the rows, so you can
+    find the event a permalink points to without rendering the log.
+    """
+    anchors = TimestampAnchors()
+    return dict((anchors.anchor(time), n)
+                for n, (time, what, info) in enumerate(events) if time)
+
+
+def write_anchor_index(index, filename):
+    """Write an anchor index as JSON."""
+    with open(filename, 'w') as f:
+        json.dump(index, f, sort_keys=True)
 
 
 if __name__ == '__main__':
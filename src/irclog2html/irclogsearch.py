@@ -13,6 +13,10 @@ Apache configuration example:
     SetEnv IRCLOG_LOCATION /path/to/irclog/files/
     # Uncomment the following if your log files use a different format
     #SetEnv IRCLOG_GLOB "*.log.????-??-??"
+    # Uncomment the following to keep parsed log files in a cache directory
+    #SetEnv IRCLOG_CACHE_DIR /var/cache/irclog2html/
+    # Uncomment the following to give every nick the same colour everywhere
+    #SetEnv IRCLOG_STABLE_COLOURS 1
   </Location>
 
 """
@@ -38,8 +42,9 @@ try:
 except ImportError:
     from urllib.parse import quote
 
-from .irclog2html import (LogParser, XHTMLTableStyle, NickColourizer,
-                          escape, open_log_file, VERSION, RELEASE)
+from .irclog2html import (LogParser, ParseCache, XHTMLTableStyle,
+                          NickColourizer, HashNickColourizer, escape,
+                          open_log_file, VERSION, RELEASE)
 from .logs2html import find_log_files
 
 
@@ -125,11 +130,13 @@ class StdoutWrapper(object):
 class SearchResultFormatter(object):
     """Formatter of search results."""
 
-    def __init__(self, stream=None):
+    def __init__(self, stream=None, nick_colour=None):
         self.stream = stream
         bstream = stream.buffer
         self.style = XHTMLTableStyle(bstream)
-        self.nick_colour = NickColourizer()
+        if nick_colour is None:
+            nick_colour = NickColourizer()
+        self.nick_colour = nick_colour
 
     def print_prefix(self):
         print(self.style.prefix, file=self.stream)
@@ -156,14 +163,44 @@ def urlescape(link):
     return escape(quote(link))
 
 
-def parse_log_file(filename):
-    with closing(open_log_file(filename)) as f:
+def parse_log_file(filename, cache=None, use_mmap=False):
+    # Log files get appended to (and rotated) while we search them, and a
+    # memory-mapped file that shrinks crashes the process, so only callers
+    # that know the file can't change should ask for use_mmap.
+    if cache is not None:
+        for row in cache.parse(filename, use_mmap=use_mmap):
+            yield row
+        return
+    with closing(open_log_file(filename, use_mmap=use_mmap)) as f:
         for row in LogParser(f):
             yield row
 
 
+def get_parse_cache(cache_dir):
+    """Return a ParseCache for cache_dir, or None if cache_dir is empty."""
+    if cache_dir:
+        return ParseCache(cache_dir)
+    else:
+        return None
+
+
+stable_nick_colour = HashNickColourizer()
+
+
+def get_nick_colourizer(stable):
+    """Return the shared HashNickColourizer if stable is set, else None.
+
+    None means that every page gets a new NickColourizer.
+    """
+    if stable:
+        return stable_nick_colour
+    else:
+        return None
+
+
 def search_irc_logs(query, stats=None, where=DEFAULT_LOGFILE_PATH,
-                    logfile_pattern=DEFAULT_LOGFILE_PATTERN, limit=None):
+                    logfile_pattern=DEFAULT_LOGFILE_PATTERN, limit=None,
+                    cache=None, use_mmap=False):
     if not stats:
         stats = SearchStats() # will be discarded, but, oh, well
     query = query.lower()
@@ -173,7 +210,8 @@ def search_irc_logs(query, stats=None, where=DEFAULT_LOGFILE_PATH,
         date = f.date
         link = f.link
         stats.files += 1
-        for timestamp, event, info in parse_log_file(f.filename):
+        rows = parse_log_file(f.filename, cache, use_mmap)
+        for timestamp, event, info in rows:
             if event == LogParser.COMMENT:
                 nick, text = info
                 text = nick + ' ' + text
@@ -209,7 +247,7 @@ def print_search_form(stream=None):
 def print_search_results(query, where=DEFAULT_LOGFILE_PATH,
                          logfile_pattern=DEFAULT_LOGFILE_PATTERN,
                          limit=100,
-                         stream=None):
+                         stream=None, cache=None, nick_colour=None):
     if stream is None:
         stream = sys.stdout
     print(HEADER, file=stream)
@@ -222,11 +260,11 @@ def print_search_results(query, where=DEFAULT_LOGFILE_PATH,
     started = time.time()
     date = None
     prev_result = None
-    formatter = SearchResultFormatter(stream)
+    formatter = SearchResultFormatter(stream, nick_colour)
     stats = SearchStats()
     for result in search_irc_logs(query, stats=stats, where=where,
                                   logfile_pattern=logfile_pattern,
-                                  limit=limit):
+                                  limit=limit, cache=cache):
         if date != result.date:
             if prev_result:
                 formatter.print_suffix()
@@ -266,7 +304,8 @@ def unicode_stdout():
                             line_buffering=True)
 
 
-def search_page(stream, form, where, logfile_pattern):
+def search_page(stream, form, where, logfile_pattern, cache=None,
+                nick_colour=None):
     if "q" not in form:
         print_search_form(stream)
     else:
@@ -274,7 +313,8 @@ def search_page(stream, form, where, logfile_pattern):
         if isinstance(search_text, bytes):
             search_text = search_text.decode('UTF-8')
         print_search_results(search_text, stream=stream, where=where,
-                             logfile_pattern=logfile_pattern)
+                             logfile_pattern=logfile_pattern, cache=cache,
+                             nick_colour=nick_colour)
 
 
 def main():
@@ -282,10 +322,13 @@ def main():
     cgitb.enable()
     logfile_path = os.getenv('IRCLOG_LOCATION') or DEFAULT_LOGFILE_PATH
     logfile_pattern = os.getenv('IRCLOG_GLOB') or DEFAULT_LOGFILE_PATTERN
+    cache = get_parse_cache(os.getenv('IRCLOG_CACHE_DIR'))
+    nick_colour = get_nick_colourizer(os.getenv('IRCLOG_STABLE_COLOURS'))
     form = cgi.FieldStorage()
     stream = unicode_stdout()
     print_cgi_headers(stream)
-    search_page(stream, form, logfile_path, logfile_pattern)
+    search_page(stream, form, logfile_path, logfile_pattern, cache,
+                nick_colour)
 
 
 if __name__ == '__main__':
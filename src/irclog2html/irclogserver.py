@@ -16,6 +16,10 @@ Apache configuration example:
     SetEnv IRCLOG_CHAN_DIR /path/to/irclog/channels/
     # Uncomment the following if your log files use a different format
     #SetEnv IRCLOG_GLOB "*.log.????-??-??"
+    # Uncomment the following to keep parsed log files in a cache directory
+    #SetEnv IRCLOG_CACHE_DIR /var/cache/irclog2html/
+    # Uncomment the following to give every nick the same colour everywhere
+    #SetEnv IRCLOG_STABLE_COLOURS 1
   </Location>
 
 """
@@ -32,7 +36,9 @@ import cgi
 import datetime
 import io
 import os
+import threading
 import time
+from collections import OrderedDict
 from operator import attrgetter
 from wsgiref.simple_server import make_server
 
@@ -43,11 +49,13 @@ except ImportError:
 
 from ._version import __version__, __date__
 from .irclog2html import (
-    CSS_FILE, LogParser, XHTMLTableStyle, convert_irc_log,
+    CSS_FILE, LogParser, NickColourizer, XHTMLTableStyle, convert_irc_log,
+    format_events,
 )
 from .logs2html import LogFile, Error, find_log_files, write_index
 from .irclogsearch import (
-    DEFAULT_LOGFILE_PATH, DEFAULT_LOGFILE_PATTERN, search_page,
+    DEFAULT_LOGFILE_PATH, DEFAULT_LOGFILE_PATTERN, get_nick_colourizer,
+    get_parse_cache, search_page,
 )
 
 
@@ -140,7 +148,111 @@ def log_listing(stream, path, pattern, channel=None):
     write_index(stream, title, logfiles, searchbox=True)
 
 
-def dynamic_log(stream, path, pattern, channel=None):
+def use_nick_palette(formatter, nick_colour):
+    """Use CSS classes for nick colours if they come from a fixed palette."""
+    palette = getattr(nick_colour, 'palette', None)
+    if palette:
+        formatter.use_nick_palette(palette)
+
+
+class RenderedLog(object):
+    """The HTML table rows of a parsed log file.
+
+    Hold ``lock`` while you call update() and getvalue().
+    """
+
+    def __init__(self, uid, nick_colour=None):
+        self.uid = uid
+        self.lock = threading.Lock()
+        self.count = 0
+        self.size = 0
+        self.buffer = io.BytesIO()
+        self.formatter = XHTMLTableStyle(self.buffer, buffered=True)
+        self.shared_nick_colour = nick_colour
+        use_nick_palette(self.formatter, nick_colour)
+        if nick_colour is None:
+            nick_colour = NickColourizer()
+        self.nick_colour = nick_colour
+
+    def update(self, log):
+        """Render the events that were appended to the log."""
+        format_events(log.iter_from(self.count), self.formatter,
+                      self.nick_colour)
+        self.formatter.outfile.flush()
+        self.count = len(log)
+        self.size = self.buffer.tell()
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+
+class RenderCache(object):
+    """Recently rendered log files.
+
+    Today's log keeps growing, and re-rendering it from the start for every
+    request gets slower as the day goes on.  This keeps the rendered rows of
+    recently viewed logs, together with the formatter and nick colour state,
+    and renders only the events that were appended since.  The least
+    recently used logs are dropped when the rendered rows of all of them
+    take more than ``max_bytes``.
+
+    ``lock`` protects only the dict of entries; rendering happens under the
+    lock of each entry, so a slow render doesn't hold up requests for other
+    log files.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def entry(self, path, log, nick_colour=None):
+        """Find or make the entry for a log file, marking it recently used."""
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if (entry is None or entry.uid != log.uid
+                    or entry.shared_nick_colour is not nick_colour):
+                entry = RenderedLog(log.uid, nick_colour)
+            self.entries[path] = entry
+            self.trim()
+            return entry
+
+    def trim(self):
+        """Drop least recently used entries until they fit in max_bytes.
+
+        Call with ``lock`` held.
+        """
+        total = sum(entry.size for entry in self.entries.values())
+        while total > self.max_bytes:
+            path, entry = self.entries.popitem(last=False)
+            total -= entry.size
+
+    def rows(self, path, log, nick_colour=None):
+        """Return the rendered rows of a ParsedLog."""
+        entry = self.entry(path, log, nick_colour)
+        with entry.lock:
+            if entry.count <= len(log):
+                entry.update(log)
+                rows = entry.getvalue()
+            else:
+                rows = None
+        if rows is None:
+            # Another request already rendered a newer version of the log
+            # than the one we have
+            entry = RenderedLog(log.uid, nick_colour)
+            entry.update(log)
+            return entry.getvalue()
+        with self.lock:
+            # the entry has grown
+            self.trim()
+        return rows
+
+
+render_cache = RenderCache()
+
+
+def dynamic_log(stream, path, pattern, channel=None, cache=None,
+                nick_colour=None):
     """Render HTML dynamically"""
     lf = LogFile(path)
     logfiles = find_log_files(os.path.dirname(path), pattern)
@@ -149,22 +261,34 @@ def dynamic_log(stream, path, pattern, channel=None):
         lf.prev = logfiles[idx - 1] if idx > 0 else None
         lf.next = logfiles[idx + 1] if idx + 1 < len(logfiles) else None
     except ValueError:
-        pass
-    with open(path, 'rb') as f:
-        parser = LogParser(f)
-        formatter = XHTMLTableStyle(stream.buffer)
-        if channel:
-            title = u"IRC log of {channel}".format(channel=channel)
-        else:
-            title = u"IRC log"
-        title += u" for {date:%A, %Y-%m-%d}".format(date=lf.date)
-        prev = ('&#171; {date:%A, %Y-%m-%d}'.format(date=lf.prev.date),
-                lf.prev.link) if lf.prev else ('', '')
-        next = ('{date:%A, %Y-%m-%d} &#187;'.format(date=lf.next.date),
-                lf.next.link) if lf.next else ('', '')
-        index = ('Index', 'index.html')
-        convert_irc_log(parser, formatter, title, prev, index, next,
-                        searchbox=True)
+        # not a log file we know about; reading it will fail
+        lf.prev = lf.next = None
+    formatter = XHTMLTableStyle(stream.buffer)
+    use_nick_palette(formatter, nick_colour)
+    if channel:
+        title = u"IRC log of {channel}".format(channel=channel)
+    else:
+        title = u"IRC log"
+    title += u" for {date:%A, %Y-%m-%d}".format(date=lf.date)
+    prev = ('&#171; {date:%A, %Y-%m-%d}'.format(date=lf.prev.date),
+            lf.prev.link) if lf.prev else ('', '')
+    next = ('{date:%A, %Y-%m-%d} &#187;'.format(date=lf.next.date),
+            lf.next.link) if lf.next else ('', '')
+    index = ('Index', 'index.html')
+    if cache is None:
+        with open(path, 'rb') as f:
+            parser = LogParser(f)
+            convert_irc_log(parser, formatter, title, prev, index, next,
+                            searchbox=True, nick_colour=nick_colour)
+        return
+    # Live logs may be truncated or rotated while we read them, so they
+    # must not be memory-mapped here
+    log = cache.parse(path, use_mmap=False)
+    rows = render_cache.rows(path, log, nick_colour)
+    formatter.head(title, prev, index, next, searchbox=True)
+    formatter.outfile.flush()
+    stream.buffer.write(rows)
+    formatter.foot()
 
 
 def parse_path(environ):
@@ -191,6 +315,8 @@ def application(environ, start_response):
     chan_path = getenv('IRCLOG_CHAN_DIR')
     logfile_path = getenv('IRCLOG_LOCATION') or DEFAULT_LOGFILE_PATH
     logfile_pattern = getenv('IRCLOG_GLOB') or DEFAULT_LOGFILE_PATTERN
+    cache = get_parse_cache(getenv('IRCLOG_CACHE_DIR'))
+    nick_colour = get_nick_colourizer(getenv('IRCLOG_STABLE_COLOURS'))
     form = cgi.FieldStorage(fp=environ['wsgi.input'], environ=environ)
     stream = io.TextIOWrapper(io.BytesIO(), 'ascii',
                               errors='xmlcharrefreplace',
@@ -212,7 +338,8 @@ def application(environ, start_response):
         dir_listing(stream, chan_path)
         result = [stream.buffer.getvalue()]
     elif path == 'search':
-        search_page(stream, form, logfile_path, logfile_pattern)
+        search_page(stream, form, logfile_path, logfile_pattern, cache,
+                    nick_colour)
         result = [stream.buffer.getvalue()]
     elif path == 'irclog.css':
         content_type = "text/css"
@@ -235,9 +362,10 @@ def application(environ, start_response):
             elif path.endswith('.html'):
                 try:
                     dynamic_log(stream, full_path[:-len('.html')],
-                                logfile_pattern, channel=channel)
+                                logfile_pattern, channel=channel,
+                                cache=cache, nick_colour=nick_colour)
                     result = [stream.buffer.getvalue()]
-                except (Error, IOError):
+                except (Error, EnvironmentError):
                     # Error will be raised if the filename has no ISO-8601 date
                     status = "404 Not Found"
                     result = [b"Not found"]
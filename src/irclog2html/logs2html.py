@@ -25,10 +25,18 @@ from operator import attrgetter
 import os
 import re
 import sys
+import stat
 import glob
+import gzip
+import json
+import time
+import hashlib
 import datetime
 import optparse
+import tempfile
+import multiprocessing
 import shutil
+from contextlib import closing
 
 try:
     from urllib import quote
@@ -66,7 +74,9 @@ class LogFile:
             raise Error("File name does not contain a YYYY-MM-DD date: %s"
                         % filename)
         self.date = datetime.date(*map(int, m.groups()))
-        self.link = irclog2html.pick_output_filename(basename)
+        # foo.log.gz and foo.log both become foo.log.html
+        self.outfilename = irclog2html.pick_output_filename(filename)
+        self.link = os.path.basename(self.outfilename)
         self.title = self.date.strftime('%Y-%m-%d (%A)')
 
     def __eq__(self, other):
@@ -85,22 +95,58 @@ class LogFile:
         if not hasattr(self, '_newfile'):
             # Only do this once, so that self.generate() does not change
             # newness
-            self._newfile = not os.path.exists(self.filename + ".html")
+            self._newfile = not os.path.exists(self.outfilename)
         return self._newfile
 
-    def uptodate(self):
-        """Check whether the HTML version of the log is up to date."""
+    def uptodate(self, gzipped=False):
+        """Check whether the HTML version of the log is up to date.
+
+        With ``gzipped``, the gzip-compressed copy of the HTML file (see
+        write_gzip_copies) must also exist and be as new as the HTML file.
+        """
         log_mtime = os.stat(self.filename).st_mtime
         try:
-            html_mtime = os.stat(self.filename + ".html").st_mtime
+            html_mtime = os.stat(self.outfilename).st_mtime
+            if gzipped:
+                gz_mtime = os.stat(self.outfilename + ".gz").st_mtime
+                if gz_mtime < html_mtime:
+                    return False
         except OSError:
             return False
         return html_mtime > log_mtime
 
+    def navigation(self, prev=None, next=None):
+        """Return the links to the previous and next log files.
+
+        Returns two (title, url) tuples, which are empty when there's no
+        previous or next log file.
+        """
+        nav_prev = nav_next = ('', '')
+        if prev:
+            nav_prev = ('&#171; ' + prev.date.strftime('%A, %Y-%m-%d'),
+                        prev.link)
+        if next:
+            nav_next = (next.date.strftime('%A, %Y-%m-%d') + ' &#187;',
+                        next.link)
+        return nav_prev, nav_next
+
     def generate(self, style, title_prefix='', prev=None, next=None,
-                 extra_args=()):
-        """Generate HTML for this log file."""
+                 extra_args=(), converter=None):
+        """Generate HTML for this log file.
+
+        Pass a `converter` made by make_converter() to convert the log in
+        this process instead of running irclog2html.main() with the
+        `style` and `extra_args`, which are then ignored.
+        """
         self.newfile() # update newness flag and remember it
+        if converter is not None:
+            title = title_prefix + self.date.strftime('%A, %Y-%m-%d')
+            nav_prev, nav_next = self.navigation(prev, next)
+            try:
+                converter.convert(self.filename, title, nav_prev, nav_next)
+            except irclog2html.Error as e:
+                raise Error(str(e))
+            return
         argv = ['irclog2html.py', '-s', style]
         argv.extend(extra_args)
         argv += ['-t', title_prefix + self.date.strftime('%A, %Y-%m-%d')]
@@ -116,6 +162,321 @@ class LogFile:
         argv += [self.filename]
         irclog2html.main(argv)
 
+    def write_gzip_copies(self, level=9, styles=()):
+        """Write gzip-compressed copies of the generated files.
+
+        These are the HTML pages, the anchor index (if there is one) and the
+        output of the additional `styles` (style classes, e.g.
+        LogConverter.styles[1:]).  Compressed copies of pages that no longer
+        exist are removed.
+        """
+        outfilename = self.outfilename
+        write_gzip_copy(outfilename, level)
+        for style in styles:
+            write_gzip_copy(irclog2html.pick_style_filename(outfilename,
+                                                            style),
+                            level)
+        anchor_index = irclog2html.pick_anchor_index_filename(outfilename)
+        if os.path.exists(anchor_index):
+            write_gzip_copy(anchor_index, level)
+        page = 2
+        while os.path.exists(irclog2html.pick_page_filename(outfilename,
+                                                            page)):
+            write_gzip_copy(irclog2html.pick_page_filename(outfilename, page),
+                            level)
+            page += 1
+        while os.path.exists(
+                irclog2html.pick_page_filename(outfilename, page) + '.gz'):
+            os.remove(irclog2html.pick_page_filename(outfilename, page)
+                      + '.gz')
+            page += 1
+
+
+def write_gzip_copy(filename, level=9):
+    """Write a gzip-compressed copy of a file next to it.
+
+    The copy is named ``filename + '.gz'``, which is where web servers look
+    for precompressed files (e.g. nginx with ``gzip_static on``).  It gets
+    the modification time and permissions of the original, so it's easy to
+    tell when it is out of date.
+
+    The copy is written to a temporary file and renamed into place, so a
+    web server never sends a half-written one.
+    """
+    with open(filename, 'rb') as fi:
+        st = os.fstat(fi.fileno())
+        mtime = st.st_mtime
+        fd, tmpname = tempfile.mkstemp(prefix='.', suffix='.tmp',
+                                       dir=os.path.dirname(filename) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as fo:
+                with closing(gzip.GzipFile(os.path.basename(filename), 'wb',
+                                           level, fo, mtime)) as gz:
+                    shutil.copyfileobj(fi, gz)
+            os.chmod(tmpname, stat.S_IMODE(st.st_mode))
+            os.utime(tmpname, (mtime, mtime))
+            # os.rename() can't overwrite files on Windows; os.replace()
+            # is Python 3.3+
+            getattr(os, 'replace', os.rename)(tmpname, filename + '.gz')
+        except EnvironmentError:
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+            raise
+
+
+def make_converter(style, extra_args=()):
+    """Make an irclog2html.LogConverter for LogFile.generate().
+
+    The converter converts logs the same way as irclog2html with the
+    given style and extra command-line arguments, and links to index.html.
+    """
+    argv = ['irclog2html.py', '-s', style,
+            '--index-url=index.html', '--index-title=Index']
+    argv.extend(extra_args)
+    parser, options, args = irclog2html.parse_args(argv)
+    try:
+        return irclog2html.LogConverter(options)
+    except irclog2html.Error as e:
+        raise Error(str(e))
+
+
+# The converter of a worker process of generate_in_parallel()
+_worker_converter = None
+
+
+def init_generation_worker(style, extra_args):
+    global _worker_converter
+    _worker_converter = make_converter(style, extra_args)
+
+
+def generate_in_worker(args):
+    """Generate HTML for a log file in a worker process.
+
+    Takes a tuple (logfile, title_prefix, prev, next, gzip_level), where
+    gzip_level is None if no compressed copies are wanted.
+
+    Returns (filename, None), or (filename, error message) if it failed.
+    """
+    logfile, title_prefix, prev, next, gzip_level = args
+    try:
+        logfile.generate(None, title_prefix, prev, next,
+                         converter=_worker_converter)
+        if gzip_level is not None:
+            logfile.write_gzip_copies(gzip_level,
+                                      _worker_converter.styles[1:])
+    except Error as e:
+        return logfile.filename, str(e)
+    except Exception as e:
+        return logfile.filename, "cannot convert %s: %s: %s" % (
+            logfile.filename, e.__class__.__name__, e)
+    return logfile.filename, None
+
+
+def generate_in_parallel(tasks, style, extra_args, jobs, done=None):
+    """Generate HTML for several log files using several processes.
+
+    `tasks` is a list of tuples for generate_in_worker().  Every worker
+    sets up its converter once, and then converts one log at a time.
+    `done(logfile)` is called for every log that was converted.
+
+    Raises Error after all the logs are done if any of them failed.
+    """
+    pool = multiprocessing.Pool(jobs, init_generation_worker,
+                                (style, list(extra_args)))
+    logfiles = dict((task[0].filename, task[0]) for task in tasks)
+    errors = []
+    try:
+        for filename, error in pool.imap_unordered(generate_in_worker, tasks):
+            if error is not None:
+                errors.append(error)
+            elif done is not None:
+                done(logfiles[filename])
+    finally:
+        pool.close()
+        pool.join()
+    if errors:
+        raise Error("%d of %d log files could not be converted:\n%s"
+                    % (len(errors), len(tasks), '\n'.join(sorted(errors))))
+
+
+class BuildManifest(object):
+    """A record of what logs2html built, and from what.
+
+    Remembers, for every log file, its size, modification time and SHA-1,
+    the output file, the links to the previous and next log, and a hash of
+    the options that affect the output (see options_hash()).  The next run
+    regenerates only the logs where any of these changed, without looking
+    at the HTML files.  Logs whose mtime changed but content didn't are not
+    regenerated.
+
+    Also remembers the list of log files and the modification time of the
+    directory, so the directory doesn't have to be listed again until files
+    are added to it or removed.
+
+    The manifest is a JSON file; it's ignored if it's missing or damaged.
+    """
+
+    FORMAT = 2
+
+    # Don't trust directory mtimes this close to now: with a coarse mtime
+    # resolution a file could be added without changing the mtime
+    MTIME_SLACK = 2
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.logs = {}
+        self.directory = None
+        self.log_names = None
+        self.index = None
+        self.load()
+        # Whether anything changed since it was loaded
+        self.changed = False
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+            if data['format'] != self.FORMAT or data['version'] != VERSION:
+                return
+            self.logs = data['logs']
+            self.directory = data['directory']
+            self.log_names = data['log_names']
+            self.index = data['index']
+        except (EnvironmentError, ValueError, KeyError, TypeError):
+            pass
+
+    def save(self):
+        """Save the manifest, atomically, if anything changed."""
+        if not self.changed:
+            return
+        data = {
+            'format': self.FORMAT,
+            'version': VERSION,
+            'logs': self.logs,
+            'directory': self.directory,
+            'log_names': self.log_names,
+            'index': self.index,
+        }
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        try:
+            fd, tmpname = tempfile.mkstemp(prefix='.', suffix='.tmp',
+                                           dir=dirname)
+        except EnvironmentError as e:
+            raise Error("cannot write %s: %s" % (self.filename, e))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                # json.dumps() is a lot faster than json.dump()
+                f.write(json.dumps(data, sort_keys=True))
+            # os.rename() can't overwrite files on Windows; os.replace()
+            # is Python 3.3+
+            getattr(os, 'replace', os.rename)(tmpname, self.filename)
+        except EnvironmentError as e:
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+            raise Error("cannot write %s: %s" % (self.filename, e))
+        self.changed = False
+
+    def find_log_files(self, directory, pattern='*.log'):
+        """Find all IRC log files in a given directory.
+
+        Like find_log_files(), but doesn't list the directory if it hasn't
+        changed since the last time.
+        """
+        key = [os.path.abspath(directory), pattern,
+               os.stat(directory).st_mtime]
+        if self.directory == key and self.log_names is not None:
+            return [LogFile(os.path.join(directory, name))
+                    for name in self.log_names]
+        logfiles = find_log_files(directory, pattern)
+        if time.time() - key[-1] > self.MTIME_SLACK:
+            self.directory = key
+        else:
+            self.directory = None
+        self.log_names = [os.path.basename(logfile.filename)
+                          for logfile in logfiles]
+        self.changed = True
+        return logfiles
+
+    def source(self, logfile):
+        """Describe the current state of a log file.
+
+        The log file is read to compute its hash only if its size or mtime
+        differ from what the manifest remembers.
+        """
+        st = os.stat(logfile.filename)
+        entry = self.logs.get(os.path.basename(logfile.filename))
+        if (entry is not None and entry['size'] == st.st_size
+                and entry['mtime'] == st.st_mtime):
+            sha1 = entry['sha1']
+        else:
+            sha1 = file_hash(logfile.filename)
+        return {'size': st.st_size, 'mtime': st.st_mtime, 'sha1': sha1}
+
+    def build(self, logfile, prev, next, options_hash):
+        """Describe how a log file is to be built."""
+        nav_prev, nav_next = logfile.navigation(prev, next)
+        return {
+            'output': logfile.link,
+            # lists, because that's what they'll be when loaded from JSON
+            'prev': list(nav_prev),
+            'next': list(nav_next),
+            'options': options_hash,
+        }
+
+    def get(self, logfile):
+        """Return what the manifest remembers about a log file, or None."""
+        return self.logs.get(os.path.basename(logfile.filename))
+
+    def record(self, logfile, source, build):
+        """Remember how a log file was built."""
+        name = os.path.basename(logfile.filename)
+        entry = dict(source, **build)
+        if self.logs.get(name) != entry:
+            self.logs[name] = entry
+            self.changed = True
+
+    def forget(self, logfile):
+        """Forget a log file, so that the next run builds it."""
+        if self.logs.pop(os.path.basename(logfile.filename), None):
+            self.changed = True
+
+    def prune(self, logfiles):
+        """Forget log files that aren't in the list."""
+        names = set(os.path.basename(logfile.filename)
+                    for logfile in logfiles)
+        for name in list(self.logs):
+            if name not in names:
+                del self.logs[name]
+                self.changed = True
+
+    def set_index(self, index_hash):
+        """Remember how the index was built."""
+        if self.index != index_hash:
+            self.index = index_hash
+            self.changed = True
+
+
+def file_hash(filename):
+    """Compute the SHA-1 of a file's contents."""
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def options_hash(*args):
+    """Compute a hash of the options that affect the output.
+
+    The arguments must be JSON-serializable.
+    """
+    data = json.dumps([VERSION] + list(args), sort_keys=True)
+    return hashlib.sha1(data.encode('UTF-8')).hexdigest()
+
 
 def find_log_files(directory, pattern='*.log'):
     """Find all IRC log files in a given directory.
@@ -123,10 +484,11 @@ def find_log_files(directory, pattern='*.log'):
     Returns a sorted list of LogFile objects (oldest first).
     """
     pattern = os.path.join(directory, pattern)
+    filenames = glob.glob(pattern)
+    for extension, opener in irclog2html.DECOMPRESSORS:
+        filenames += glob.glob(pattern + extension)
     # ISO 8601 dates sort the way we need them
-    return sorted([LogFile(filename)
-                   for filename in glob.glob(pattern)
-                                   + glob.glob(pattern + '.gz')],
+    return sorted([LogFile(filename) for filename in filenames],
                   key=attrgetter('filename'))
 
 
@@ -197,7 +559,9 @@ def main(argv=sys.argv):
     parser.add_option('-s', '--style', dest="style", default="xhtmltable",
                       help="format log according to specific style"
                            " (default: xhtmltable); passes the style name"
-                           " to irclog2html.py")
+                           " to irclog2html.py.  Several comma-separated"
+                           " styles convert each log to all of them, e.g."
+                           " -s xhtmltable,ndjson")
     parser.add_option('-t', '--title', dest="title", default="IRC logs",
                       help="title of the index page (default: IRC logs)")
     parser.add_option('-p', '--prefix', dest="prefix", default="",
@@ -214,6 +578,44 @@ def main(argv=sys.argv):
     parser.add_option('-g', '--glob-pattern', dest="pattern", default="*.log",
                       help="glob pattern that finds log files to be processed"
                       " (default: *.log)")
+    parser.add_option('--cache-dir', metavar='DIR',
+                      default=os.environ.get('IRCLOG_CACHE_DIR'),
+                      help="keep parsed log files in DIR and skip parsing"
+                           " unchanged files (default: $IRCLOG_CACHE_DIR,"
+                           " if set)")
+    parser.add_option('--stable-colors', '--stable-colours',
+                      action='store_true', dest='stable_colours',
+                      default=False,
+                      help="pick nick colours by hashing the nick, so that"
+                           " every nick keeps its colour across log files;"
+                           " passed to irclog2html.py")
+    parser.add_option('--nick-classes', action='store_true', default=False,
+                      help="refer to nick colours by CSS classes instead of"
+                           " inline styles (implies --stable-colours);"
+                           " passed to irclog2html.py")
+    parser.add_option('--anchor-index', action='store_true', default=False,
+                      help="write an index of the timestamp anchors of every"
+                           " log next to its HTML; passed to irclog2html.py")
+    parser.add_option('--page-size', metavar='N', type='int', default=0,
+                      help="split every log into pages of N lines;"
+                           " passed to irclog2html.py")
+    parser.add_option('--manifest', metavar='FILE',
+                      help="remember what was built, and from what, in FILE,"
+                           " and next time regenerate only the logs whose"
+                           " contents, neighbours or relevant options"
+                           " changed, without checking the HTML files"
+                           " (delete FILE or use --force if you delete or"
+                           " edit HTML files by hand)")
+    parser.add_option('-j', '--jobs', metavar='N', type='int', default=1,
+                      help="convert N log files at a time in separate"
+                           " processes (default: 1)")
+    parser.add_option('-z', '--gzip', action='store_true', default=False,
+                      help="also write gzip-compressed copies (.gz) of"
+                           " all generated files, for web servers that can"
+                           " serve precompressed files")
+    parser.add_option('--gzip-level', metavar='LEVEL', type='int', default=9,
+                      help="compression level for --gzip, from 1 (fastest)"
+                           " to 9 (smallest; the default)")
     options, args = parser.parse_args(argv[1:])
     if len(args) < 1:
         parser.error("missing directory name")
@@ -234,8 +636,37 @@ def process(dir, options):
         extra_args += ['-S']
     if options.dircproxy:
         extra_args += ['--dircproxy']
-    logfiles = find_log_files(dir, options.pattern)
+    if getattr(options, 'stable_colours', False):
+        extra_args += ['--stable-colours']
+    if getattr(options, 'nick_classes', False):
+        extra_args += ['--nick-classes']
+    if getattr(options, 'anchor_index', False):
+        extra_args += ['--anchor-index']
+    if getattr(options, 'page_size', 0):
+        extra_args += ['--page-size', str(options.page_size)]
+    gzipped = getattr(options, 'gzip', False)
+    gzip_level = getattr(options, 'gzip_level', 9)
+    build_hash = options_hash(options.style, options.prefix, extra_args,
+                              gzip_level if gzipped else None)
+    cache_dir = getattr(options, 'cache_dir', None)
+    if cache_dir:
+        extra_args += ['--cache-dir', cache_dir]
+    manifest_filename = getattr(options, 'manifest', None)
+    if manifest_filename:
+        manifest = BuildManifest(manifest_filename)
+        logfiles = manifest.find_log_files(dir, options.pattern)
+    else:
+        manifest = None
+        logfiles = find_log_files(dir, options.pattern)
+    converter = make_converter(options.style, extra_args)
     logfiles.reverse() # newest first
+    # Decide which logs to regenerate before regenerating any, because
+    # generating a log makes it look not new to its neighbours.  Logs that
+    # only need new links to their neighbours get their navigation bars
+    # patched instead.
+    stale = []
+    patches = []
+    builds = {}
     for n, logfile in enumerate(logfiles):
         if n > 0:
             next = logfiles[n - 1]
@@ -245,15 +676,93 @@ def process(dir, options):
             prev = logfiles[n + 1]
         else:
             prev = None
-        if (options.force or not logfile.uptodate()
-            or prev and prev.newfile() or next and next.newfile()):
-            logfile.generate(options.style, options.prefix, prev, next,
-                             extra_args)
+        entry = manifest.get(logfile) if manifest is not None else None
+        old_nav = None
+        if entry is None:
+            regenerate = options.force or not logfile.uptodate(gzipped)
+            if (not regenerate and (prev and prev.newfile()
+                                    or next and next.newfile())):
+                # the links were made when the new logs weren't there
+                old_nav = logfile.navigation(
+                    find_old_neighbour(logfiles, n + 1, 1),
+                    find_old_neighbour(logfiles, n - 1, -1))
+        else:
+            regenerate = False
+        if manifest is not None:
+            source = manifest.source(logfile)
+            build = manifest.build(logfile, prev, next, build_hash)
+            builds[logfile.filename] = source, build
+            if entry is not None:
+                regenerate = (options.force or entry['sha1'] != source['sha1']
+                              or any(entry[key] != build[key]
+                                     for key in ('output', 'options')))
+                if (not regenerate and (entry['prev'] != build['prev']
+                                        or entry['next'] != build['next'])):
+                    old_nav = tuple(entry['prev']), tuple(entry['next'])
+            if regenerate or old_nav:
+                manifest.forget(logfile)
+            else:
+                manifest.record(logfile, source, build)
+        if regenerate:
+            stale.append((logfile, prev, next))
+        elif old_nav:
+            patches.append((logfile, prev, next, old_nav))
+
+    def done(logfile):
+        if manifest is not None:
+            manifest.record(logfile, *builds[logfile.filename])
+
+    jobs = getattr(options, 'jobs', 1)
+    try:
+        for logfile, prev, next, old_nav in patches:
+            if converter.patch_navigation(logfile.filename, *(
+                    old_nav + logfile.navigation(prev, next))):
+                if gzipped:
+                    logfile.write_gzip_copies(gzip_level,
+                                              converter.styles[1:])
+                done(logfile)
+            else:
+                stale.append((logfile, prev, next))
+        if jobs > 1 and len(stale) > 1:
+            # so that the workers don't all try to copy it at the same time
+            converter.copy_css(dir)
+            generate_in_parallel(
+                [(logfile, options.prefix, prev, next,
+                  gzip_level if gzipped else None)
+                 for logfile, prev, next in stale],
+                options.style, extra_args, jobs, done)
+        else:
+            for logfile, prev, next in stale:
+                logfile.generate(options.style, options.prefix, prev, next,
+                                 extra_args, converter=converter)
+                if gzipped:
+                    logfile.write_gzip_copies(gzip_level,
+                                              converter.styles[1:])
+                done(logfile)
+    finally:
+        if manifest is not None:
+            manifest.prune(logfiles)
+            manifest.save()
+    css_file = os.path.join(dir, 'irclog.css')
+    if not os.path.exists(css_file) and os.path.exists(CSS_FILE):
+        shutil.copy(CSS_FILE, css_file)
     latest_log_link = None
     if logfiles and hasattr(os, "symlink"):
         latest_log_link = 'latest.log.html'
-        move_symlink(logfiles[0].link, os.path.join(dir, latest_log_link))
     outfilename = os.path.join(dir, 'index.html')
+    index_hash = options_hash(options.title, options.searchbox,
+                              latest_log_link, gzip_level if gzipped else None,
+                              [logfile.link for logfile in logfiles])
+    if (manifest is not None and not options.force
+            and manifest.index == index_hash
+            and os.path.exists(outfilename)):
+        # nothing to update
+        return
+    if latest_log_link:
+        move_symlink(logfiles[0].link, os.path.join(dir, latest_log_link))
+        if gzipped:
+            move_symlink(logfiles[0].link + '.gz',
+                         os.path.join(dir, latest_log_link + '.gz'))
     try:
         outfile = open(outfilename, 'w')
     except IOError as e:
@@ -263,9 +772,26 @@ def process(dir, options):
                     latest_log_link)
     finally:
         outfile.close()
-    css_file = os.path.join(dir, 'irclog.css')
-    if not os.path.exists(css_file) and os.path.exists(CSS_FILE):
-        shutil.copy(CSS_FILE, css_file)
+    if gzipped:
+        try:
+            write_gzip_copy(outfilename, gzip_level)
+        except IOError as e:
+            raise Error("cannot write %s.gz: %s" % (outfilename, e))
+    if manifest is not None:
+        manifest.set_index(index_hash)
+        manifest.save()
+
+
+def find_old_neighbour(logfiles, n, step):
+    """Find the nearest log file that is not new, starting at logfiles[n].
+
+    Returns None if there isn't one.
+    """
+    while 0 <= n < len(logfiles):
+        if not logfiles[n].newfile():
+            return logfiles[n]
+        n += step
+    return None
 
 
 def move_symlink(src, dst):
@@ -2,17 +2,25 @@ from __future__ import print_function
 
 import doctest
 import io
+import json
 import os
 import shutil
 import sys
 import tempfile
 import unittest
+import zlib
+from array import array
+from contextlib import closing
 
 from irclog2html.irclog2html import (
-    LogParser, ColourChooser, NickColourizer,
+    LogParser, ParsedLog, ParseCache, MappedLogFile, BlockWriter, RowTemplate,
+    TimestampAnchors, ColourChooser, NickColourizer, HashNickColourizer,
     SimpleTextStyle, TextStyle, SimpleTableStyle, TableStyle,
-    XHTMLStyle, XHTMLTableStyle, MediaWikiStyle,
-    COLOURS, parse_args, main)
+    XHTMLStyle, XHTMLTableStyle, MediaWikiStyle, NDJSONStyle,
+    COLOURS, open_log_file, pick_output_filename, pick_page_filename,
+    pick_style_filename, convert_irc_log,
+    read_chunks, read_file_list, split_log_file,
+    parse_log_file_in_parallel, anchor_index, parse_args, main)
 
 
 try:
@@ -149,6 +157,17 @@ def doctest_LogParser():
 
         >>> test('what is this line doing in my IRC log file?')
         None OTHER 'what is this line doing in my IRC log file?'
+        >>> test('14:18 ** almost an action')
+        '14:18' OTHER '** almost an action'
+        >>> test('14:18 ')
+        '14:18' OTHER ''
+
+    When several patterns match, the first one in the list wins
+
+        >>> test('<-- someone> left')
+        None COMMENT ('-- someone', 'left')
+        >>> test('*** X is now known as Y because he quit')
+        None PART '*** X is now known as Y because he quit'
 
     """
 
@@ -178,6 +197,52 @@ def doctest_LogParser_dircproxy_support():
     """
 
 
+def doctest_LogParser_custom_regexps():
+    r"""Tests for LogParser
+
+    Subclasses can override the regexps, flags and all
+
+        >>> import re
+        >>> class MyLogParser(LogParser):
+        ...     JOIN_REGEXP = re.compile(r'^(?:\*\*\*|-->)\s.*joined',
+        ...                              re.IGNORECASE)
+
+        >>> def test(line):
+        ...     for time, what, info in MyLogParser([line]):
+        ...         print(myrepr(time), what, myrepr(info))
+
+        >>> test('*** povbot has JOINED #pov')
+        None JOIN '*** povbot has JOINED #pov'
+        >>> test('*** povbot has quit IRC')
+        None PART '*** povbot has quit IRC'
+        >>> test('*** mg is now known as mgedmin')
+        None NICKCHANGE ('*** mg is now known as mgedmin', 'mg', 'mgedmin')
+        >>> test('* mg waves')
+        None ACTION '* mg waves'
+        >>> test('--- topic is now something')
+        None SERVER '--- topic is now something'
+        >>> test('<mg> hi')
+        None COMMENT ('mg', 'hi')
+
+    Such regexps can't be combined with the others, so they're tried one by
+    one, but only for the lines they might match
+
+        >>> dispatch = MyLogParser([]).dispatch
+        >>> dispatch['*'][0] is None, dispatch['<'][0] is None
+        (True, False)
+
+    The same goes for regexps with backreferences
+
+        >>> class MyLogParser(LogParser):
+        ...     NICK_REGEXP = re.compile(r'^<(.*?)(!.*?)?>\s(?!\1\b)')
+        >>> test('<mg> mg is me')
+        None OTHER '<mg> mg is me'
+        >>> test('<mg> hi')
+        None COMMENT ('mg', 'hi')
+
+    """
+
+
 def doctest_LogParser_encodings():
     r"""Tests for LogParser
 
@@ -205,6 +270,596 @@ def doctest_LogParser_encodings():
     """
 
 
+def doctest_LogParser_sniff_time_regexp():
+    r"""Tests for LogParser.sniff_time_regexp
+
+        >>> parser = LogParser([])
+        >>> parser.sniff_time_regexp([
+        ...     '[12:00] <mg> hi', '[12:01] <mg> hello',
+        ... ]) is parser.TIME_FORMATS[-1]
+        True
+        >>> parser.sniff_time_regexp([
+        ...     'Jan 08 12:00:00 <mg> hi', '12:01 <mg> hello',
+        ...     'Jan 08 12:02:00 <mg> bye',
+        ... ]) is parser.TIME_FORMATS[2]
+        True
+        >>> parser.sniff_time_regexp([
+        ...     '<mg> hi', '<mg> hello',
+        ... ]) is parser.TIME_REGEXP
+        True
+
+    Lines that don't fit the chosen format are still parsed
+
+        >>> lines = ['2005-01-08T12:00:00 <mg> hi'] * 3 + [
+        ...     '[12:01] <mg> hello', '<mg> no time']
+        >>> for time, what, info in LogParser(lines):
+        ...     print(myrepr(time), what, myrepr(info))
+        '2005-01-08T12:00:00' COMMENT ('mg', 'hi')
+        '2005-01-08T12:00:00' COMMENT ('mg', 'hi')
+        '2005-01-08T12:00:00' COMMENT ('mg', 'hi')
+        '12:01' COMMENT ('mg', 'hello')
+        None COMMENT ('mg', 'no time')
+
+    """
+
+
+def doctest_LogParser_offset():
+    r"""Tests for LogParser with an offset
+
+        >>> f = io.BytesIO(b'<mg> one\n<mg> two\n<mg> thr')
+        >>> parser = LogParser(f)
+        >>> for time, what, info in parser:
+        ...     print(what, myrepr(info))
+        COMMENT ('mg', 'one')
+        COMMENT ('mg', 'two')
+        COMMENT ('mg', 'thr')
+
+    The last line was incomplete
+
+        >>> parser.offset, parser.partial
+        (18, True)
+
+    We can continue from where we stopped
+
+        >>> f = io.BytesIO(b'<mg> one\n<mg> two\n<mg> three\n<mg> four\n')
+        >>> parser = LogParser(f, offset=18)
+        >>> for time, what, info in parser:
+        ...     print(what, myrepr(info))
+        COMMENT ('mg', 'three')
+        COMMENT ('mg', 'four')
+        >>> parser.offset, parser.partial
+        (39, False)
+
+    """
+
+
+def doctest_LogParser_decode_chunk():
+    r"""Tests for LogParser.decode_chunk
+
+    Chunks of whole lines are decoded the same way decode() decodes
+    individual lines
+
+        >>> print(myrepr(LogParser.decode_chunk(b'\xc4\x85\n\x9a\n\xc4\x85\n')))
+        '\u0105\n\u0161\n\u0105\n'
+        >>> print(myrepr(LogParser.decode_chunk(b'\xc4\n\x85\n')))
+        '\xc4\n\u2026\n'
+
+    """
+
+
+def doctest_LogParser_reads_files_in_chunks():
+    r"""Tests for LogParser
+
+    LogParser reads files in chunks of CHUNK_SIZE bytes, taking care of lines
+    that cross chunk boundaries
+
+        >>> f = io.BytesIO(b'14:18 <mg> UTF-8: \xc4\x85\n'
+        ...                b'14:18 <mg> cp1252: \x9a\r\n'
+        ...                b'\n'
+        ...                b'14:19 * mg has no newline')
+        >>> parser = LogParser(f)
+        >>> parser.CHUNK_SIZE = 5
+        >>> for time, what, info in parser:
+        ...     print(myrepr(time), what, myrepr(info))
+        '14:18' COMMENT ('mg', 'UTF-8: \u0105')
+        '14:18' COMMENT ('mg', 'cp1252: \u0161')
+        '14:19' ACTION '* mg has no newline'
+
+    """
+
+
+def doctest_ParsedLog():
+    r"""Tests for ParsedLog
+
+        >>> sample = os.path.join(here, 'sample.log')
+        >>> with open_log_file(sample) as f:
+        ...     log = ParsedLog(LogParser(f))
+        >>> with open_log_file(sample) as f:
+        ...     list(log) == list(LogParser(f))
+        True
+
+    Events are stored in columns
+
+        >>> log = ParsedLog([
+        ...     ('12:00', LogParser.COMMENT, ('mg', 'hi')),
+        ...     ('12:00', LogParser.NICKCHANGE,
+        ...      ('*** mg is now known as mgedmin', 'mg', 'mgedmin')),
+        ...     (None, LogParser.OTHER, 'something'),
+        ... ])
+        >>> len(log)
+        3
+        >>> list(log.events), list(log.times), list(log.nicks)
+        ([0, 4, 6], [0, 0, -1], [0, 0, -1])
+        >>> print(log.text)
+        hi*** mg is now known as mgedminsomething
+        >>> print(*log.offsets)
+        0 2 32 41
+
+    but iterate as tuples
+
+        >>> for time, event, info in log:
+        ...     print(myrepr(time), event, myrepr(info))
+        '12:00' COMMENT ('mg', 'hi')
+        '12:00' NICKCHANGE ('*** mg is now known as mgedmin', 'mg', 'mgedmin')
+        None OTHER 'something'
+
+        >>> print(myrepr(log[-1]))
+        (None, OTHER, 'something')
+        >>> log[3]
+        Traceback (most recent call last):
+          ...
+        IndexError: 3
+
+    You can append more events
+
+        >>> log.extend([('12:01', LogParser.COMMENT, ('mgedmin', 'bye'))])
+        >>> for time, event, info in log:
+        ...     print(myrepr(time), event, myrepr(info))
+        '12:00' COMMENT ('mg', 'hi')
+        '12:00' NICKCHANGE ('*** mg is now known as mgedmin', 'mg', 'mgedmin')
+        None OTHER 'something'
+        '12:01' COMMENT ('mgedmin', 'bye')
+
+    You can look at the end only
+
+        >>> for time, event, info in log.iter_from(2):
+        ...     print(myrepr(time), event, myrepr(info))
+        None OTHER 'something'
+        '12:01' COMMENT ('mgedmin', 'bye')
+
+    or drop it
+
+        >>> uid = log.uid
+        >>> log.truncate(5)
+        >>> log.uid == uid
+        True
+        >>> log.truncate(1)
+        >>> for time, event, info in log:
+        ...     print(myrepr(time), event, myrepr(info))
+        '12:00' COMMENT ('mg', 'hi')
+        >>> log.uid == uid
+        False
+        >>> log.extend([('12:00', LogParser.NICKCHANGE,
+        ...              ('*** mg is now known as mgedmin', 'mg', 'mgedmin')),
+        ...             (None, LogParser.OTHER, 'something'),
+        ...             ('12:01', LogParser.COMMENT, ('mgedmin', 'bye'))])
+
+    or append another ParsedLog
+
+        >>> other = ParsedLog([
+        ...     (None, LogParser.OTHER, 'something else'),
+        ...     ('12:00', LogParser.NICKCHANGE,
+        ...      ('*** someone is now known as mgedmin', 'someone', 'mgedmin')),
+        ... ])
+        >>> copy = ParsedLog(log)
+        >>> copy.extend(other)
+        >>> list(copy) == list(log) + list(other)
+        True
+        >>> print(*copy.nick_table)
+        mg mgedmin someone
+
+    ParsedLog objects can be pickled
+
+        >>> import pickle
+        >>> copy = pickle.loads(pickle.dumps(log))
+        >>> list(copy) == list(log)
+        True
+        >>> copy.extend([('12:02', LogParser.COMMENT, ('mgedmin', 'ok'))])
+        >>> list(copy.nicks)
+        [0, 0, -1, 1, 1]
+
+    """
+
+
+def doctest_ParsedLog_dump_load():
+    r"""Tests for ParsedLog.dump and ParsedLog.load
+
+        >>> log = ParsedLog([
+        ...     ('12:00', LogParser.COMMENT, ('mg', 'hi \u263a')),
+        ...     ('12:00', LogParser.NICKCHANGE,
+        ...      ('*** mg is now known as mgedmin', 'mg', 'mgedmin')),
+        ...     (None, LogParser.OTHER, 'something'),
+        ... ])
+        >>> f = io.BytesIO()
+        >>> log.dump(f)
+        >>> _ = f.seek(0)
+        >>> copy = ParsedLog.load(f)
+        >>> list(copy) == list(log)
+        True
+
+    Truncated files are rejected
+
+        >>> f = io.BytesIO(f.getvalue()[:-1])
+        >>> ParsedLog.load(f)
+        Traceback (most recent call last):
+          ...
+        ValueError: truncated file
+
+    and so are files that store an array with a different type (e.g. the
+    32-bit offsets of older versions)
+
+        >>> log.offsets = array(str('I'), log.offsets)
+        >>> f = io.BytesIO()
+        >>> log.dump(f)
+        >>> _ = f.seek(0)
+        >>> ParsedLog.load(f)
+        Traceback (most recent call last):
+          ...
+        ValueError: type code mismatch
+
+    """
+
+
+def doctest_ParseCache():
+    r"""Tests for ParseCache
+
+        >>> tmpdir = tempfile.mkdtemp(prefix='irclog2html-test-')
+        >>> fn = os.path.join(tmpdir, 'sample.log')
+        >>> _ = shutil.copy(os.path.join(here, 'sample.log'), fn)
+        >>> cache = ParseCache(os.path.join(tmpdir, 'cache'))
+
+    The cache directory is created when needed
+
+        >>> log = cache.parse(fn)
+        >>> with open_log_file(fn) as f:
+        ...     list(log) == list(LogParser(f))
+        True
+        >>> os.listdir(cache.directory) == [
+        ...     os.path.basename(cache.cache_filename(fn))]
+        True
+
+    Unchanged files are not parsed again
+
+        >>> inode = os.stat(cache.cache_filename(fn)).st_ino
+        >>> list(cache.parse(fn)) == list(log)
+        True
+        >>> os.stat(cache.cache_filename(fn)).st_ino == inode
+        True
+
+    Changed files are
+
+        >>> with open(fn, 'ab') as f:
+        ...     _ = f.write(b'<mg> one more line\n')
+        >>> list(cache.parse(fn))[-1] == (None, LogParser.COMMENT,
+        ...                               ('mg', 'one more line'))
+        True
+
+    When lines are appended only the new lines are parsed
+
+        >>> with open(fn, 'ab') as f:
+        ...     _ = f.write(b'<mg> and anoth')
+        >>> log = cache.parse(fn)
+        >>> uid = log.uid
+        >>> with open(fn, 'ab') as f:
+        ...     _ = f.write(b'er\n<mg> and another one\n')
+        >>> log = cache.parse(fn)
+        >>> log.uid == uid
+        False
+        >>> uid = log.uid
+        >>> with open(fn, 'ab') as f:
+        ...     _ = f.write(b'<mg> the end\n')
+
+    (command-line tools can ask for the log file to be memory-mapped)
+
+        >>> log = cache.parse(fn, use_mmap=True)
+        >>> log.uid == uid
+        True
+        >>> with open_log_file(fn) as f:
+        ...     list(log) == list(LogParser(f))
+        True
+
+    unless the file was changed in other ways
+
+        >>> with open(fn, 'r+b') as f:
+        ...     _ = f.seek(-4, 2)
+        ...     _ = f.write(b'END!\n\n')
+        >>> log = cache.parse(fn)
+        >>> log.uid == uid
+        False
+        >>> for time, what, info in list(log)[-3:]:
+        ...     print(what, myrepr(info))
+        COMMENT ('mg', 'and another')
+        COMMENT ('mg', 'and another one')
+        COMMENT ('mg', 'the END!')
+
+    dircproxy logs are parsed differently, so they're kept separately
+
+        >>> cache.cache_filename(fn) != cache.cache_filename(fn, dircproxy=True)
+        True
+
+    Damaged cache files are ignored
+
+        >>> with open(cache.cache_filename(fn), 'r+b') as f:
+        ...     _ = f.truncate(100)
+        >>> list(cache.parse(fn)) == list(log)
+        True
+
+    Problems writing to the cache are ignored too
+
+        >>> cache = ParseCache(os.path.join(fn, 'not-a-directory'))
+        >>> list(cache.parse(fn)) == list(log)
+        True
+
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
+def doctest_open_log_file_compressed():
+    r"""Tests for open_log_file
+
+        >>> import bz2, gzip, zlib
+        >>> from irclog2html.irclog2html import lzma
+        >>> tmpdir = tempfile.mkdtemp(prefix='irclog2html-test-')
+        >>> with open(os.path.join(here, 'sample.log'), 'rb') as f:
+        ...     data = f.read()
+        >>> def write(filename, data):
+        ...     fn = os.path.join(tmpdir, filename)
+        ...     with open(fn, 'wb') as f:
+        ...         _ = f.write(data)
+        ...     return fn
+        >>> compressed = [
+        ...     write('sample.log.bz2', bz2.compress(data)),
+        ...     write('sample.log.zz', zlib.compress(data)),
+        ... ]
+        >>> with closing(gzip.open(os.path.join(tmpdir, 'sample.log.gz'),
+        ...                        'wb')) as f:
+        ...     _ = f.write(data)
+        >>> compressed.append(os.path.join(tmpdir, 'sample.log.gz'))
+        >>> if lzma is not None:
+        ...     compressed.append(write('sample.log.xz', lzma.compress(data)))
+
+    Compressed log files are decompressed on the fly
+
+        >>> for fn in compressed:
+        ...     with closing(open_log_file(fn)) as f:
+        ...         assert f.read() == data, fn
+        ...     with closing(open_log_file(fn)) as f:
+        ...         assert list(f) == data.splitlines(True), fn
+
+    Several compressed streams one after another are fine
+
+        >>> fn = write('twice.log.bz2', bz2.compress(data[:100]) +
+        ...                             bz2.compress(data[100:]))
+        >>> with closing(open_log_file(fn)) as f:
+        ...     f.read() == data
+        True
+
+    Seeking works, if slowly
+
+        >>> with closing(open_log_file(fn)) as f:
+        ...     _ = f.seek(100)
+        ...     print(myrepr(f.read(10).decode('ascii')))
+        ...     _ = f.seek(5)
+        ...     print(myrepr(f.read(10).decode('ascii')))
+        ...     f.tell()
+        'ing works.'
+        '01-08T23:3'
+        15
+
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
+if hasattr(zlib.decompressobj(), 'eof'):
+    # Python 2's decompressors can't tell a truncated stream from a whole one
+
+    def doctest_open_log_file_truncated():
+        r"""Tests for open_log_file
+
+        Truncated compressed files are an error, not a shorter log
+
+            >>> import bz2
+            >>> tmpdir = tempfile.mkdtemp(prefix='irclog2html-test-')
+            >>> with open(os.path.join(here, 'sample.log'), 'rb') as f:
+            ...     data = f.read()
+            >>> for ext, compress in [('.bz2', bz2.compress),
+            ...                       ('.zz', zlib.compress)]:
+            ...     fn = os.path.join(tmpdir, 'sample.log' + ext)
+            ...     with open(fn, 'wb') as f:
+            ...         _ = f.write(compress(data)[:-10])
+            ...     with closing(open_log_file(fn)) as f:
+            ...         try:
+            ...             _ = f.read()
+            ...         except EOFError as e:
+            ...             print(e)
+            Compressed file ended before the end-of-stream marker was reached
+            Compressed file ended before the end-of-stream marker was reached
+
+        irclog2html reports them like other errors
+
+            >>> run(fn, '-o', tmpdir)
+            SystemExit('irclog2html: cannot read ...sample.log.zz: Compressed file ended before the end-of-stream marker was reached')
+
+            >>> shutil.rmtree(tmpdir)
+
+        """
+
+
+def doctest_pick_output_filename():
+    """Tests for pick_output_filename
+
+        >>> print(pick_output_filename('/path/to/channel.log'))
+        /path/to/channel.log.html
+        >>> print(pick_output_filename('/path/to/channel.log.gz'))
+        /path/to/channel.log.html
+        >>> print(pick_output_filename('/path/to/channel.log.xz'))
+        /path/to/channel.log.html
+
+    """
+
+
+def doctest_split_log_file():
+    r"""Tests for split_log_file
+
+        >>> tmpdir = tempfile.mkdtemp(prefix='irclog2html-test-')
+        >>> fn = os.path.join(tmpdir, 'sample.log')
+        >>> with open(fn, 'wb') as f:
+        ...     _ = f.write(b'one\ntwo\nthree\nfour\nfive\n')
+
+    The pieces start and end at line boundaries
+
+        >>> split_log_file(fn, 3, min_size=1)
+        [(0, 14), (14, 19), (19, 24)]
+
+    Small files aren't split
+
+        >>> split_log_file(fn, 3)
+        [(0, 24)]
+
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
+def doctest_parse_log_file_in_parallel():
+    r"""Tests for parse_log_file_in_parallel
+
+        >>> sample = os.path.join(here, 'sample.log')
+        >>> log = parse_log_file_in_parallel(sample, 3, min_size=1)
+        >>> with open_log_file(sample) as f:
+        ...     list(log) == list(LogParser(f))
+        True
+
+    """
+
+
+def doctest_read_chunks():
+    r"""Tests for read_chunks
+
+        >>> f = io.BytesIO(b'one\ntwo\nthree\nlast')
+        >>> for chunk in read_chunks(f, 5):
+        ...     print(myrepr(chunk.decode('ascii')))
+        'one\n'
+        'two\n'
+        'three\n'
+        'last'
+
+    """
+
+
+def doctest_MappedLogFile():
+    r"""Tests for MappedLogFile
+
+        >>> tmpdir = tempfile.mkdtemp(prefix='irclog2html-test-')
+        >>> fn = os.path.join(tmpdir, 'sample.log')
+        >>> with open(fn, 'wb') as f:
+        ...     _ = f.write(b'one\ntwo\nthree\nlast')
+
+    It can be iterated over like a binary file
+
+        >>> with open_log_file(fn, use_mmap=True) as f:
+        ...     for line in f:
+        ...         print(myrepr(line.decode('ascii')))
+        'one\n'
+        'two\n'
+        'three\n'
+        'last'
+
+    It can also split itself into chunks of whole lines
+
+        >>> with open_log_file(fn, use_mmap=True) as f:
+        ...     for chunk in f.read_chunks(5):
+        ...         print(myrepr(chunk.decode('ascii')))
+        'one\n'
+        'two\n'
+        'three\n'
+        'last'
+
+        >>> with open_log_file(fn, use_mmap=True) as f:
+        ...     for chunk in f.read_chunks(1000):
+        ...         print(myrepr(chunk.decode('ascii')))
+        'one\ntwo\nthree\n'
+        'last'
+
+    and supports read(), seek() and tell()
+
+        >>> f = open_log_file(fn, use_mmap=True)
+        >>> print(myrepr(f.read(2).decode('ascii')))
+        'on'
+        >>> f.seek(-4, 2)
+        14
+        >>> print(myrepr(f.read().decode('ascii')))
+        'last'
+        >>> f.tell()
+        18
+        >>> f.close()
+
+    LogParser can read it
+
+        >>> with open_log_file(fn, use_mmap=True) as f:
+        ...     for time, what, info in LogParser(f):
+        ...         print(myrepr(time), what, myrepr(info))
+        None OTHER 'one'
+        None OTHER 'two'
+        None OTHER 'three'
+        None OTHER 'last'
+
+    Empty files cannot be memory-mapped, but that is handled
+
+        >>> open(fn, 'w').close()
+        >>> with open_log_file(fn, use_mmap=True) as f:
+        ...     print(list(LogParser(f)))
+        []
+
+        >>> shutil.rmtree(tmpdir)
+
+    Pipes and other special files have no size, so they cannot be mapped
+
+        >>> r, w = os.pipe()
+        >>> os.close(w)
+        >>> with io.open(r, 'rb') as f:
+        ...     MappedLogFile(f)
+        Traceback (most recent call last):
+          ...
+        ValueError: cannot map ...: not a regular file
+
+    """
+
+
+if os.path.isdir('/dev/fd'):
+
+    def doctest_open_log_file_pipe():
+        r"""Tests for open_log_file
+
+        Pipes (like /dev/stdin or <(...) in bash) are read normally even when
+        you ask for a memory-mapped file
+
+            >>> r, w = os.pipe()
+            >>> _ = os.write(w, b'one\ntwo\n')
+            >>> os.close(w)
+            >>> with closing(open_log_file('/dev/fd/%d' % r,
+            ...                            use_mmap=True)) as f:
+            ...     for time, what, info in LogParser(f):
+            ...         print(myrepr(time), what, myrepr(info))
+            None OTHER 'one'
+            None OTHER 'two'
+            >>> os.close(r)
+
+        """
+
+
 def doctest_ColourChooser():
     """Test for ColourChooser
 
@@ -262,6 +917,52 @@ def doctest_NickColourizer():
     """
 
 
+def doctest_HashNickColourizer():
+    """Test for HashNickColourizer
+
+        >>> nc = HashNickColourizer()
+
+    The colour comes from a palette computed in advance
+
+        >>> len(nc.palette)
+        64
+        >>> nc['mgedmin'] in nc.palette
+        True
+
+    It depends only on the nick, not on the nicks that came before it
+
+        >>> nc['povbot'] == HashNickColourizer()['povbot']
+        True
+        >>> nc['mgedmin'] == HashNickColourizer()['mgedmin']
+        True
+        >>> nc[u'\u017eilvinas'] in nc.palette
+        True
+
+    Nick changes don't affect anything
+
+        >>> colour = nc['mgedmin']
+        >>> nc.change('mgedmin', 'mg_away')
+        >>> nc['mgedmin'] == colour
+        True
+
+    Different nicks get different colours, as long as the palette has room
+
+        >>> len(set(nc['nick%d' % n] for n in range(100))) > 40
+        True
+
+    Only a limited number of nicks are remembered
+
+        >>> colour = nc['nick0']
+        >>> for n in range(nc.CACHE_SIZE * 2):
+        ...     _ = nc['nick%d' % n]
+        >>> len(nc.nick_colour) <= nc.CACHE_SIZE
+        True
+        >>> nc['nick0'] == colour
+        True
+
+    """
+
+
 class BytesIOWrapper(object):
     charset = 'UTF-8'
     closed = False
@@ -286,6 +987,126 @@ class BytesIOWrapper(object):
         self.stream.flush()
 
 
+def doctest_RowTemplate():
+    """Test for RowTemplate
+
+        >>> row = RowTemplate('<p id="{anchor}">{text} <a href="#{anchor}">'
+        ...                   '100%</a> {{literal}}</p>')
+        >>> row.fields
+        ['anchor', 'text']
+        >>> print(row(anchor='t12:00', text='Hello'))
+        <p id="t12:00">Hello <a href="#t12:00">100%</a> {literal}</p>
+        >>> print(row('t12:00', 'Hello'))
+        <p id="t12:00">Hello <a href="#t12:00">100%</a> {literal}</p>
+
+    As a class attribute it turns into the compiled function
+
+        >>> class MyStyle(XHTMLStyle):
+        ...     servermsg_row_untimed = RowTemplate(
+        ...         '<div class="{css_class}">{text}</div>')
+        >>> style = MyStyle(BytesIOWrapper(sys.stdout))
+        >>> style.servermsg(None, LogParser.JOIN, '*** wombat joins')
+        <div class="join">*** wombat joins</div>
+
+    Only plain named fields are supported
+
+        >>> RowTemplate('{text!r}')
+        Traceback (most recent call last):
+          ...
+        ValueError: unsupported template field: {text}
+        >>> RowTemplate('{0}')
+        Traceback (most recent call last):
+          ...
+        ValueError: unsupported template field: {0}
+
+    """
+
+
+def doctest_TimestampAnchors():
+    """Test for TimestampAnchors
+
+        >>> anchors = TimestampAnchors()
+        >>> for t in ['12:00', '12:00', '12:01', '12:00', '12:00']:
+        ...     print(anchors.anchor(t))
+        t12:00
+        t12:00-2
+        t12:01
+        t12:00-2-3
+        t12:00-2-3-4
+
+    """
+
+
+def doctest_anchor_index():
+    """Test for anchor_index
+
+        >>> events = [('12:00', LogParser.COMMENT, ('mg', 'hi')),
+        ...           (None, LogParser.JOIN, '*** povbot joins'),
+        ...           ('12:00', LogParser.COMMENT, ('mg', 'hello')),
+        ...           ('12:01', LogParser.COMMENT, ('mg', 'bye'))]
+        >>> for anchor, n in sorted(anchor_index(events).items()):
+        ...     print(anchor, n)
+        t12:00 0
+        t12:00-2 2
+        t12:01 3
+
+    """
+
+
+def doctest_BlockWriter():
+    """Test for BlockWriter
+
+        >>> out = io.BytesIO()
+        >>> w = BlockWriter(out, 'US-ASCII', block_size=10)
+
+    Nothing is written until a block fills up
+
+        >>> print('Hello', file=w)
+        >>> out.getvalue() == b''
+        True
+        >>> print('world!', file=w)
+        >>> print(myrepr(out.getvalue().decode('ascii')))
+        'Hello\\nworld!'
+
+    or until you flush
+
+        >>> print(u'\\u0105\\u010d\\u0119', file=w)
+        >>> w.flush()
+        >>> print(myrepr(out.getvalue().decode('ascii')))
+        'Hello\\nworld!\\n&#261;&#269;&#281;\\n'
+
+    Detaching flushes too
+
+        >>> w.write('bye')
+        >>> w.detach() is out
+        True
+        >>> w.closed
+        True
+        >>> print(myrepr(out.getvalue().decode('ascii')[-5:]))
+        ';\\nbye'
+
+    """
+
+
+def doctest_XHTMLTableStyle_buffered():
+    """Test for XHTMLTableStyle
+
+        >>> out = io.BytesIO()
+        >>> style = XHTMLTableStyle(out, buffered=True)
+        >>> style.nicktext('02:24', 'mgedmin', u'\\u263a', '#77ff77')
+        >>> out.getvalue() == b''
+        True
+        >>> style.outfile.flush()
+        >>> print(out.getvalue().decode('UTF-8') == (
+        ...     u'<tr id="t02:24"><th class="nick" style="background: #77ff77">'
+        ...     u'mgedmin</th><td class="text" style="color: #77ff77">'
+        ...     u'\\u263a</td><td class="time">'
+        ...     u'<a href="#t02:24" class="time">02:24</a></td></tr>\\n'))
+        True
+
+    """
+
+
 def doctest_SimpleTextStyle():
     """Test for SimpleTextStyle
 
@@ -610,6 +1431,94 @@ def doctest_XHTMLTableStyle():
     """
 
 
+def doctest_XHTMLTableStyle_nick_cell():
+    """Test for XHTMLTableStyle.nick_cell
+
+        >>> style = XHTMLTableStyle(BytesIOWrapper(sys.stdout))
+        >>> cell = style.nick_cell('mg<x>', '#77ff77')
+        >>> print(cell[0])
+        <th class="nick" style="background: #77ff77">mg&lt;x&gt;</th>
+
+    The nick cell is rendered once for every nick and colour
+
+        >>> style.nick_cell('mg<x>', '#77ff77') is cell
+        True
+        >>> print(style.nick_cell('mg<x>', '#ff7777')[0])
+        <th class="nick" style="background: #ff7777">mg&lt;x&gt;</th>
+
+    but the cache doesn't grow without bounds
+
+        >>> style.NICK_CELL_CACHE_SIZE = 3
+        >>> for nick in ['a', 'b', 'c', 'd']:
+        ...     _ = style.nick_cell(nick, '#77ff77')
+        >>> len(style._nick_cells)
+        3
+
+    Switching to CSS classes forgets the cells with inline styles
+
+        >>> style.use_nick_palette(['#77ff77'])
+        >>> print(style.nick_cell('mg<x>', '#77ff77')[0])
+        <th class="nick nc0">mg&lt;x&gt;</th>
+
+    """
+
+
+def doctest_XHTMLStyle_nick_palette():
+    """Test for XHTMLStyle.use_nick_palette
+
+        >>> style = XHTMLStyle(BytesIOWrapper(sys.stdout))
+        >>> style.use_nick_palette(['#77ff77', '#ff7777'])
+        >>> style.head('IRC logs of #channel for Monday, 2008-06-10')
+        <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN"
+        ...
+          <meta name="version" content="..." />
+          <style type="text/css">
+            span.nc0 { color: #77ff77 }
+            span.nc1 { color: #ff7777 }
+          </style>
+        </head>
+        ...
+
+        >>> style.nicktext('02:24:17', 'mgedmin', 'Hello, world!', '#ff7777')
+        <p id="t02:24:17" class="comment"><a href="#t02:24:17" class="time">02:24</a> <span class="nick nc1">&lt;mgedmin&gt;</span> <span class="text">Hello, world!</span></p>
+
+    Colours that are not in the palette are still written inline
+
+        >>> style.nicktext(None, 'mgedmin', 'what time is it?', '#7777ff')
+        <p class="comment"><span class="nick" style="color: #7777ff">&lt;mgedmin&gt;</span> <span class="text">what time is it?</span></p>
+
+    """
+
+
+def doctest_XHTMLTableStyle_nick_palette():
+    """Test for XHTMLTableStyle.use_nick_palette
+
+        >>> style = XHTMLTableStyle(BytesIOWrapper(sys.stdout))
+        >>> style.use_nick_palette(['#77ff77', '#ff7777'])
+        >>> style.head('IRC logs of #channel for Monday, 2008-06-10')
+        <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN"
+        ...
+          <style type="text/css">
+            th.nc0 { background: #77ff77 }
+            td.nc0 { color: #77ff77 }
+            th.nc1 { background: #ff7777 }
+            td.nc1 { color: #ff7777 }
+          </style>
+        </head>
+        ...
+
+        >>> style.nicktext('02:24:17', 'mgedmin', 'Hello, world!', '#77ff77')
+        <tr id="t02:24:17"><th class="nick nc0">mgedmin</th><td class="text nc0">Hello, world!</td><td class="time"><a href="#t02:24:17" class="time">02:24</a></td></tr>
+
+        >>> style.nicktext(None, 'mgedmin', 'what time is it?', '#77ff77')
+        <tr><th class="nick nc0">mgedmin</th><td class="text nc0" colspan="2">what time is it?</td></tr>
+
+        >>> style.nicktext(None, 'mgedmin', 'what time is it?', '#7777ff')
+        <tr><th class="nick" style="background: #7777ff">mgedmin</th><td class="text" colspan="2" style="color: #7777ff">what time is it?</td></tr>
+
+    """
+
+
 def doctest_MediaWikiStyle():
     r"""Tests for MediaWikiStyle
 
@@ -687,6 +1596,80 @@ def doctest_MediaWikiStyle():
     """
 
 
+def doctest_convert_irc_log_several_formatters():
+    """Test for convert_irc_log
+
+    You can convert a log to several styles at once
+
+        >>> log = ParsedLog()
+        >>> log.extend(LogParser(['12:00 <mg> hi', '12:01 * mg waves',
+        ...                       '12:01 <povbot> hello']))
+        >>> styles = [XHTMLTableStyle, MediaWikiStyle, NDJSONStyle]
+        >>> outputs = [io.BytesIO() for style in styles]
+        >>> convert_irc_log(log, [style(f) for style, f in zip(styles, outputs)],
+        ...                 'Title', ('', ''), ('', ''), ('', ''))
+        >>> print(outputs[2].getvalue().decode('UTF-8'))
+        {"anchor": "t12:00", "colour": "#...", "nick": "mg", "text": "hi", "time": "12:00", "type": "COMMENT"}
+        {"anchor": "t12:01", "colour": null, "nick": null, "text": "* mg waves", "time": "12:01", "type": "ACTION"}
+        {"anchor": "t12:01-2", "colour": "#...", "nick": "povbot", "text": "hello", "time": "12:01", "type": "COMMENT"}
+        <BLANKLINE>
+
+    and get the same output as when converting it to each of them
+
+        >>> for style, output in zip(styles, outputs):
+        ...     f = io.BytesIO()
+        ...     convert_irc_log(log, style(f), 'Title', ('', ''), ('', ''),
+        ...                     ('', ''))
+        ...     print(style.name, f.getvalue() == output.getvalue())
+        xhtmltable True
+        mediawiki True
+        ndjson True
+
+    """
+
+
+def doctest_NDJSONStyle():
+    r"""Test for NDJSONStyle
+
+        >>> style = NDJSONStyle(BytesIOWrapper(sys.stdout),
+        ...                     {LogParser.PART: '#000099'})
+
+    There's no header
+
+        >>> style.head('IRC logs of #channel for Monday, 2008-06-10')
+
+    Every event is a JSON object on a line of its own
+
+        >>> style.nicktext('2008-06-10T02:24:17', 'mgedmin', 'Hello, <world>!',
+        ...                '#77ff77')
+        {"anchor": "t2008-06-10T02:24:17", "colour": "#77ff77", "nick": "mgedmin", "text": "Hello, <world>!", "time": "2008-06-10T02:24:17", "type": "COMMENT"}
+
+        >>> style.servermsg('10-Jun-2008 02:24', LogParser.PART,
+        ...                 '* mgedmin leaves')
+        {"anchor": "t10-Jun-2008 02:24", "colour": "#000099", "nick": null, "text": "* mgedmin leaves", "time": "2008-06-10T02:24", "type": "PART"}
+
+        >>> style.servermsg('10-Jun-2008 02:24', LogParser.ACTION,
+        ...                 '* mgedmin says "hi"')
+        {"anchor": "t10-Jun-2008 02:24-2", "colour": null, "nick": null, "text": "* mgedmin says \"hi\"", "time": "2008-06-10T02:24", "type": "ACTION"}
+
+        >>> style.nicktext(None, 'mgedmin', 'what time is it?', '#77ff77')
+        {"anchor": null, "colour": "#77ff77", "nick": "mgedmin", "text": "what time is it?", "time": null, "type": "COMMENT"}
+
+    There's no footer either
+
+        >>> style.foot()
+
+    Non-ASCII text is written as UTF-8
+
+        >>> buf = io.BytesIO()
+        >>> style = NDJSONStyle(buf)
+        >>> style.nicktext(None, 'mg', u'\u0105', '#77ff77')
+        >>> b'"text": "\xc4\x85"' in buf.getvalue()
+        True
+
+    """
+
+
 def run(*args):
     stderr = sys.stderr
     try:
@@ -781,6 +1764,238 @@ def doctest_main():
     """
 
 
+def doctest_main_parse_jobs():
+    """Test for main
+
+        >>> tmpdir = tempfile.mkdtemp(prefix='irclog2html-test-')
+        >>> fn = os.path.join(here, 'sample.log')
+        >>> run(fn, '-o', os.path.join(tmpdir, 'serial.html'))
+        >>> run(fn, '--parse-jobs', '2', '-o',
+        ...     os.path.join(tmpdir, 'parallel.html'))
+        >>> with open(os.path.join(tmpdir, 'serial.html'), 'rb') as f1:
+        ...     with open(os.path.join(tmpdir, 'parallel.html'), 'rb') as f2:
+        ...         f1.read() == f2.read()
+        True
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
+def doctest_main_stable_colours():
+    """Test for main
+
+        >>> tmpdir = tempfile.mkdtemp(prefix='irclog2html-test-')
+        >>> fn = os.path.join(here, 'sample.log')
+        >>> outfilename = os.path.join(tmpdir, 'sample.log.html')
+        >>> run(fn, '--stable-colours', '-o', outfilename)
+        >>> with io.open(outfilename, encoding='UTF-8') as f:
+        ...     html = f.read()
+        >>> colour = HashNickColourizer()['mgedmin']
+        >>> '<th class="nick" style="background: %s">mgedmin' % colour in html
+        True
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
+def doctest_main_nick_classes():
+    """Test for main
+
+        >>> tmpdir = tempfile.mkdtemp(prefix='irclog2html-test-')
+        >>> fn = os.path.join(here, 'sample.log')
+        >>> outfilename = os.path.join(tmpdir, 'sample.log.html')
+        >>> run(fn, '--nick-classes', '-o', outfilename)
+        >>> with io.open(outfilename, encoding='UTF-8') as f:
+        ...     html = f.read()
+        >>> nc = HashNickColourizer()
+        >>> cls = 'nc%d' % nc.palette.index(nc['mgedmin'])
+        >>> '<th class="nick %s">mgedmin' % cls in html
+        True
+        >>> 'th.%s { background: %s }' % (cls, nc['mgedmin']) in html
+        True
+        >>> 'style="background' in html
+        False
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
+def doctest_main_anchor_index():
+    """Test for main
+
+        >>> tmpdir = tempfile.mkdtemp(prefix='irclog2html-test-')
+        >>> fn = os.path.join(here, 'sample.log')
+        >>> outfilename = os.path.join(tmpdir, 'sample.log.html')
+        >>> run(fn, '--anchor-index', '-o', outfilename)
+        >>> sorted(os.listdir(tmpdir))
+        ['irclog.css', 'sample.log.anchors.json', 'sample.log.html']
+        >>> with open(os.path.join(tmpdir, 'sample.log.anchors.json')) as f:
+        ...     index = json.load(f)
+        >>> with io.open(outfilename, encoding='UTF-8') as f:
+        ...     html = f.read()
+        >>> all('<tr id="%s">' % anchor in html for anchor in index)
+        True
+        >>> len(index) == html.count('<tr id=')
+        True
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
+def doctest_main_page_size():
+    """Test for main
+
+        >>> tmpdir = tempfile.mkdtemp(prefix='irclog2html-test-')
+        >>> fn = os.path.join(tmpdir, 'sample.log')
+        >>> _ = shutil.copy(os.path.join(here, 'sample.log'), fn)
+        >>> run(fn, '--page-size', '4', '--prev-title', 'Yesterday',
+        ...     '--prev-url', 'yesterday.html')
+        >>> sorted(os.listdir(tmpdir))
+        ... # doctest: +NORMALIZE_WHITESPACE
+        ['irclog.css', 'sample.log', 'sample.log.anchors.json',
+         'sample.log.html', 'sample.log.p2.html', 'sample.log.p3.html']
+
+        >>> def show(filename):
+        ...     with io.open(os.path.join(tmpdir, filename),
+        ...                  encoding='UTF-8') as f:
+        ...         for line in f:
+        ...             if line.startswith('<tr id'):
+        ...                 print(line.split('>')[0] + '>')
+        ...             elif '<title>' in line or 'navigation' in line:
+        ...                 print(line.rstrip())
+
+        >>> show('sample.log.html')
+          <title>...sample.log (page 1 of 3)</title>
+        <div class="navigation"> <a href="yesterday.html">Yesterday</a> <a href="sample.log.p2.html">Page 2 &#187;</a> </div>
+        <tr id="t2005-01-08T23:33:54">
+        <tr id="t2005-01-08T23:34:46">
+        <tr id="t2005-01-08T23:37:22">
+        <tr id="t2005-01-08T23:46:35">
+        <div class="navigation"> <a href="yesterday.html">Yesterday</a> <a href="sample.log.p2.html">Page 2 &#187;</a> </div>
+
+    The anchors continue on the next page
+
+        >>> show('sample.log.p2.html')
+          <title>...sample.log (page 2 of 3)</title>
+        <div class="navigation"> <a href="sample.log.html">&#171; Page 1</a> <a href="sample.log.p3.html">Page 3 &#187;</a> </div>
+        <tr id="t2005-01-08T23:47:17">
+        <tr id="t2005-01-08T23:47:19">
+        <tr id="t2005-01-08T23:47:19-2">
+        <tr id="t2005-01-08T23:47:50">
+        <div class="navigation"> <a href="sample.log.html">&#171; Page 1</a> <a href="sample.log.p3.html">Page 3 &#187;</a> </div>
+
+    and permalinks to page 1 find their way to the right page
+
+        >>> with open(os.path.join(tmpdir, 'sample.log.anchors.json')) as f:
+        ...     print(json.load(f)['t2005-01-08T23:47:19-2'])
+        6
+        >>> with open(os.path.join(tmpdir, 'sample.log.html')) as f:
+        ...     '"sample.log.anchors.json"' in f.read()
+        True
+
+    Old pages disappear when there are fewer of them
+
+        >>> run(fn, '--page-size', '5')
+        >>> sorted(os.listdir(tmpdir))
+        ... # doctest: +NORMALIZE_WHITESPACE
+        ['irclog.css', 'sample.log', 'sample.log.anchors.json',
+         'sample.log.html', 'sample.log.p2.html']
+
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
+def doctest_pick_page_filename():
+    """Test for pick_page_filename
+
+        >>> print(pick_page_filename('/tmp/2016-12-08.log.html', 1))
+        /tmp/2016-12-08.log.html
+        >>> print(pick_page_filename('/tmp/2016-12-08.log.html', 2))
+        /tmp/2016-12-08.log.p2.html
+
+    """
+
+
+def doctest_pick_style_filename():
+    """Test for pick_style_filename
+
+        >>> print(pick_style_filename('/tmp/2016-12-08.log.html', NDJSONStyle))
+        /tmp/2016-12-08.log.ndjson
+        >>> print(pick_style_filename('/tmp/2016-12-08.log.html', XHTMLStyle))
+        /tmp/2016-12-08.log.xhtml.html
+
+    """
+
+
+def doctest_main_several_styles():
+    """Test for main
+
+        >>> tmpdir = tempfile.mkdtemp(prefix='irclog2html-test-')
+        >>> fn = os.path.join(here, 'sample.log')
+        >>> outfilename = os.path.join(tmpdir, 'sample.log.html')
+        >>> run(fn, '-s', 'xhtmltable,mediawiki,ndjson', '-o', outfilename)
+        >>> sorted(os.listdir(tmpdir))
+        ['irclog.css', 'sample.log.html', 'sample.log.ndjson', 'sample.log.wiki']
+        >>> with io.open(os.path.join(tmpdir, 'sample.log.ndjson'),
+        ...              encoding='UTF-8') as f:
+        ...     events = [json.loads(line) for line in f]
+        >>> len(events)
+        10
+        >>> with io.open(outfilename, encoding='UTF-8') as f:
+        ...     html = f.read()
+        >>> all('<tr id="%s">' % event['anchor'] in html for event in events)
+        True
+        >>> with io.open(os.path.join(tmpdir, 'sample.log.wiki'),
+        ...              encoding='UTF-8') as f:
+        ...     print(f.readline().rstrip())
+        {|
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
+def doctest_read_file_list():
+    r"""Test for read_file_list
+
+        >>> for name in read_file_list(io.StringIO(u'a.log\nb c.log\n\n')):
+        ...     print(repr(name).lstrip('u'))
+        'a.log'
+        'b c.log'
+        >>> for name in read_file_list(io.StringIO(u'a.log\0b\nc.log\0'),
+        ...                            null=True):
+        ...     print(repr(name).lstrip('u'))
+        'a.log'
+        'b\nc.log'
+
+    """
+
+
+def doctest_main_jobs():
+    """Test for main
+
+        >>> tmpdir = tempfile.mkdtemp(prefix='irclog2html-test-')
+        >>> for name in ['a.log', 'b.log', 'c.log']:
+        ...     _ = shutil.copyfile(os.path.join(here, 'sample.log'),
+        ...                         os.path.join(tmpdir, name))
+        >>> with open(os.path.join(tmpdir, 'files'), 'w') as f:
+        ...     _ = f.write('\\0'.join(os.path.join(tmpdir, name)
+        ...                           for name in ['b.log', 'nosuch.log',
+        ...                                        'c.log']))
+
+    Errors are reported for every file, after converting all the others
+
+        >>> run(os.path.join(tmpdir, 'a.log'), '--jobs', '2',
+        ...     '--files-from', os.path.join(tmpdir, 'files'), '-0')
+        irclog2html: cannot open ...nosuch.log for reading: ...
+        SystemExit('irclog2html: 1 of 4 files could not be converted')
+        >>> sorted(name for name in os.listdir(tmpdir) if name.endswith('.html'))
+        ['a.log.html', 'b.log.html', 'c.log.html']
+        >>> shutil.rmtree(tmpdir)
+
+    """
+
+
 def doctest_main_can_handle_output_errors():
     """Test for main
 
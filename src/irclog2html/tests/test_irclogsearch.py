@@ -156,6 +156,26 @@ def doctest_search_irc_logs_limit():
     """
 
 
+def doctest_search_irc_logs_cache():
+    """Test for search_irc_logs
+
+        >>> from irclog2html.irclog2html import ParseCache
+        >>> tmpdir = set_up_sample()
+        >>> cache = ParseCache(os.path.join(tmpdir, 'cache'))
+        >>> for n in range(2):
+        ...     for r in search_irc_logs('seen', where=tmpdir, limit=1,
+        ...                              cache=cache):
+        ...         print('%s %s %s %s %s' % (r.link, r.date, r.time, r.event, myrepr(r.info)))
+        sample-2013-03-18.log.html 2013-03-18 2005-01-08T23:47:17 COMMENT ('mgedmin', 'seen mgedmin')
+        sample-2013-03-18.log.html 2013-03-18 2005-01-08T23:47:17 COMMENT ('mgedmin', 'seen mgedmin')
+        >>> len(os.listdir(cache.directory))
+        1
+
+        >>> clean_up_sample(tmpdir)
+
+    """
+
+
 def doctest_print_search_form():
     """Test for print_search_form
 
@@ -258,7 +278,8 @@ def doctest_search_page():
         >>> search_page("The stream", form, "/logs", "#dev*.logs")
         >>> values['print_search_results'].assert_called_once_with(
         ...     '123', logfile_pattern='#dev*.logs',
-        ...     stream='The stream', where='/logs')
+        ...     stream='The stream', where='/logs', cache=None,
+        ...     nick_colour=None)
 
     When there is no query, the search form is displayed:
 
@@ -11,7 +11,9 @@ from contextlib import closing
 
 import mock
 
-from irclog2html.irclogserver import dir_listing, parse_path, application
+from irclog2html.irclog2html import LogParser, ParsedLog
+from irclog2html.irclogserver import (
+    dir_listing, parse_path, application, RenderCache)
 
 
 here = os.path.dirname(__file__)
@@ -170,6 +172,64 @@ class Response(object):
     pass
 
 
+class TestRenderCache(unittest.TestCase):
+
+    def make_log(self, *texts):
+        return ParsedLog([('12:00', LogParser.COMMENT, ('mg', text))
+                          for text in texts])
+
+    def test_rows_incrementally(self):
+        cache = RenderCache()
+        log = self.make_log('hello')
+        rows = cache.rows('a.log', log)
+        self.assertIn(b'hello', rows)
+        log.extend([('12:01', LogParser.COMMENT, ('mg', 'bye'))])
+        rows = cache.rows('a.log', log)
+        self.assertIn(b'hello', rows)
+        self.assertIn(b'bye', rows)
+        self.assertEqual(cache.entries['a.log'].count, 2)
+
+    def test_rows_does_not_wait_for_other_logs(self):
+        cache = RenderCache()
+        slow = cache.entry('slow.log', self.make_log('slow'))
+        with slow.lock:
+            # a slow render of one log holds only that log's lock
+            self.assertIn(b'fast', cache.rows('fast.log',
+                                              self.make_log('fast')))
+
+    def test_rows_of_older_version(self):
+        cache = RenderCache()
+        log = self.make_log('hello', 'bye')
+        cache.rows('a.log', log)
+        old = ParsedLog(log)
+        old.truncate(1)
+        old.uid = log.uid
+        rows = cache.rows('a.log', old)
+        self.assertIn(b'hello', rows)
+        self.assertNotIn(b'bye', rows)
+        self.assertEqual(cache.entries['a.log'].count, 2)
+
+    def test_size_limit(self):
+        size = len(RenderCache().rows('a.log', self.make_log('a.log')))
+        cache = RenderCache(max_bytes=size * 2)
+        for name in ['a.log', 'b.log', 'c.log']:
+            cache.rows(name, self.make_log(name))
+        self.assertEqual(list(cache.entries), ['b.log', 'c.log'])
+        cache.rows('b.log', self.make_log('b.log'))
+        cache.rows('d.log', self.make_log('d.log'))
+        self.assertEqual(list(cache.entries), ['b.log', 'd.log'])
+
+    def test_size_limit_counts_growth(self):
+        log = self.make_log('a.log')
+        size = len(RenderCache().rows('a.log', log))
+        cache = RenderCache(max_bytes=size * 2)
+        cache.rows('a.log', log)
+        cache.rows('b.log', self.make_log('b.log'))
+        log.extend([('12:01', LogParser.COMMENT, ('mg', 'more'))])
+        cache.rows('a.log', log)
+        self.assertEqual(list(cache.entries), ['a.log'])
+
+
 class TestApplication(unittest.TestCase):
 
     def setUp(self):
@@ -245,6 +305,40 @@ class TestApplication(unittest.TestCase):
         self.assertIn(u'ąčę'.encode('UTF-8'), response.body)
         self.assertIn(u'š'.encode('UTF-8'), response.body)
 
+    def test_dynamic_log_file_html_cached(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        for n in range(2):
+            response = self.request('/sample-2013-03-18.log.html',
+                                    extra_env={'IRCLOG_CACHE_DIR': cache_dir})
+            self.assertIn(
+                b'<td class="join" colspan="2">*** povbot has joined #pov</td>',
+                response.body)
+            self.assertIn(u'ąčę'.encode('UTF-8'), response.body)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_dynamic_log_file_html_cached_incrementally(self):
+        cache_env = {'IRCLOG_CACHE_DIR': os.path.join(self.tmpdir, 'cache')}
+        self.request('/sample-2013-03-18.log.html', extra_env=cache_env)
+        with open(os.path.join(self.tmpdir, 'sample-2013-03-18.log'),
+                  'ab') as f:
+            f.write(b'2005-01-08T23:47:19  <mgedmin> seen mgedmin again\n')
+        response = self.request('/sample-2013-03-18.log.html',
+                                extra_env=cache_env)
+        self.assertIn(b'seen mgedmin again', response.body)
+        self.assertEqual(
+            response.body,
+            self.request('/sample-2013-03-18.log.html').body)
+
+    def test_dynamic_log_file_html_stable_colours(self):
+        env = {'IRCLOG_STABLE_COLOURS': '1'}
+        response = self.request('/sample-2013-03-18.log.html', extra_env=env)
+        self.assertIn(b'<style type="text/css">', response.body)
+        self.assertNotIn(b'style="background', response.body)
+        env['IRCLOG_CACHE_DIR'] = os.path.join(self.tmpdir, 'cache')
+        self.assertEqual(
+            response.body,
+            self.request('/sample-2013-03-18.log.html', extra_env=env).body)
+
     def test_builtin_css(self):
         response = self.request('/irclog.css')
         self.assertEqual(response.content_type, 'text/css')
@@ -271,6 +365,12 @@ class TestApplication(unittest.TestCase):
         self.assertEqual(response.content_type, 'text/plain')
         self.assertIn(b'Not found', response.body)
 
+    def test_html_not_found_cached(self):
+        cache_env = {'IRCLOG_CACHE_DIR': os.path.join(self.tmpdir, 'cache')}
+        response = self.request('/sample-2013-03-19.log.html', expect=404,
+                                extra_env=cache_env)
+        self.assertIn(b'Not found', response.body)
+
     def test_html_not_found_stupid_corner_case(self):
         response = self.request('/2016-09-25.html', expect=404)
         self.assertEqual(response.content_type, 'text/plain')
@@ -1,5 +1,6 @@
 import datetime
 import doctest
+import gzip
 import os
 import time
 import shutil
@@ -8,9 +9,10 @@ import tempfile
 import unittest
 import optparse
 
+from irclog2html.irclog2html import HashNickColourizer, find_style
 from irclog2html.logs2html import (
-    Error, LogFile, find_log_files, write_index, process, move_symlink,
-    main)
+    Error, LogFile, BuildManifest, find_log_files, write_index,
+    write_gzip_copy, make_converter, process, move_symlink, main)
 
 
 class TestCase(unittest.TestCase):
@@ -103,6 +105,24 @@ class TestLogFile(TestCase):
         lf = self.LogFile('somechannel-20130317.log')
         self.assertFalse(lf.uptodate()) # err on the safe side: regenerate
 
+    def test_uptodate_gzipped(self):
+        self.create('somechannel-20130317.log', mtime=-100)
+        self.create('somechannel-20130317.log.html', mtime=-50)
+        lf = self.LogFile('somechannel-20130317.log')
+        self.assertFalse(lf.uptodate(gzipped=True))
+        self.create('somechannel-20130317.log.html.gz', mtime=-70)
+        self.assertFalse(lf.uptodate(gzipped=True))
+        self.create('somechannel-20130317.log.html.gz', mtime=-50)
+        self.assertTrue(lf.uptodate(gzipped=True))
+
+    def test_uptodate_compressed(self):
+        self.create('somechannel-20130317.log.gz', mtime=-100)
+        self.create('somechannel-20130317.log.html', mtime=-50)
+        self.create('somechannel-20130317.log.html.gz', mtime=-50)
+        lf = self.LogFile('somechannel-20130317.log.gz')
+        self.assertFalse(lf.newfile())
+        self.assertTrue(lf.uptodate(gzipped=True))
+
     def test_generate(self):
         self.create('somechannel-20130317.log')
         lf = self.LogFile('somechannel-20130317.log')
@@ -119,6 +139,72 @@ class TestLogFile(TestCase):
         outfile = self.filename('somechannel-20130317.log.html')
         self.assertTrue(os.path.exists(outfile))
 
+    def test_write_gzip_copies(self):
+        self.create('somechannel-20130317.log.html', mtime=-10)
+        self.create('somechannel-20130317.log.p2.html', mtime=-10)
+        self.create('somechannel-20130317.log.p3.html.gz')
+        lf = self.LogFile('somechannel-20130317.log')
+        lf.write_gzip_copies()
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['somechannel-20130317.log.html',
+                          'somechannel-20130317.log.html.gz',
+                          'somechannel-20130317.log.p2.html',
+                          'somechannel-20130317.log.p2.html.gz'])
+
+    def test_write_gzip_copies_of_other_styles(self):
+        self.create('somechannel-20130317.log.html', mtime=-10)
+        self.create('somechannel-20130317.log.ndjson', mtime=-10)
+        self.create('somechannel-20130317.log.anchors.json', mtime=-10)
+        lf = self.LogFile('somechannel-20130317.log')
+        lf.write_gzip_copies(styles=[find_style('ndjson')])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['somechannel-20130317.log.anchors.json',
+                          'somechannel-20130317.log.anchors.json.gz',
+                          'somechannel-20130317.log.html',
+                          'somechannel-20130317.log.html.gz',
+                          'somechannel-20130317.log.ndjson',
+                          'somechannel-20130317.log.ndjson.gz'])
+
+    def test_write_gzip_copy(self):
+        with open(self.filename('index.html'), 'w') as f:
+            f.write('<html></html>\n')
+        os.utime(self.filename('index.html'), (1000000000, 1000000000))
+        os.chmod(self.filename('index.html'), 0o640)
+        write_gzip_copy(self.filename('index.html'), level=1)
+        with gzip.open(self.filename('index.html.gz'), 'rb') as f:
+            self.assertEqual(f.read(), b'<html></html>\n')
+        self.assertEqual(os.stat(self.filename('index.html.gz')).st_mtime,
+                         1000000000)
+        self.assertEqual(os.stat(self.filename('index.html.gz')).st_mode
+                         & 0o777, 0o640)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['index.html', 'index.html.gz'])
+
+    def test_generate_with_converter(self):
+        self.create('somechannel-20130317.log')
+        prev = self.LogFile('somechannel-20130316.log')
+        lf = self.LogFile('somechannel-20130317.log')
+        converter = make_converter('xhtmltable', ['-S'])
+        lf.generate(style='ignored', title_prefix='IRC logs for ', prev=prev,
+                    converter=converter)
+        outfile = self.filename('somechannel-20130317.log.html')
+        with open(outfile) as f:
+            html = f.read()
+        self.assertIn('<title>IRC logs for Sunday, 2013-03-17</title>', html)
+        self.assertIn('<a href="somechannel-20130316.log.html">'
+                      '&#171; Saturday, 2013-03-16</a>', html)
+        self.assertIn('<a href="index.html">Index</a>', html)
+        self.assertIn('<div class="searchbox">', html)
+
+    def test_generate_with_converter_handles_errors(self):
+        lf = self.LogFile('somechannel-20130317.log')
+        converter = make_converter('xhtmltable')
+        self.assertRaises(Error, lf.generate, 'xhtmltable',
+                          converter=converter)
+
+    def test_make_converter_unknown_style(self):
+        self.assertRaises(Error, make_converter, 'nosuchstyle')
+
     def test_find_log_files(self):
         self.create('somechannel-20130316.log')
         self.create('somechannel-20130316.log.html')
@@ -129,6 +215,18 @@ class TestLogFile(TestCase):
                           self.LogFile('somechannel-20130317.log'),
                           self.LogFile('somechannel-20130318.log')])
 
+    def test_find_log_files_compressed(self):
+        self.create('somechannel-20130316.log.bz2')
+        self.create('somechannel-20130317.log.gz')
+        self.create('somechannel-20130318.log.xz')
+        self.create('somechannel-20130319.log.zz')
+        self.create('somechannel-20130320.log.html')
+        self.assertEqual(find_log_files(self.tmpdir),
+                         [self.LogFile('somechannel-20130316.log.bz2'),
+                          self.LogFile('somechannel-20130317.log.gz'),
+                          self.LogFile('somechannel-20130318.log.xz'),
+                          self.LogFile('somechannel-20130319.log.zz')])
+
     def test_move_symlink(self):
         if not hasattr(os, 'symlink'):
             if not hasattr(self, 'skipTest'): # Python 2.6
@@ -164,6 +262,314 @@ class TestLogFile(TestCase):
         self.assertTrue(os.path.exists(
             self.filename('somechannel-20130318.log.html')))
 
+    def test_process_with_cache_dir(self):
+        self.create('somechannel-20130316.log')
+        self.create('somechannel-20130317.log')
+        options = optparse.Values(dict(searchbox=True, dircproxy=True,
+                                       pattern='*.log', force=True,
+                                       prefix='IRC logs for ',
+                                       style='xhtmltable', title='IRC logs',
+                                       cache_dir=self.filename('cache')))
+        process(self.tmpdir, options)
+        self.assertEqual(len(os.listdir(self.filename('cache'))), 2)
+
+    def test_process_with_stable_colours(self):
+        self.create('somechannel-20130316.log')
+        options = optparse.Values(dict(searchbox=True, dircproxy=True,
+                                       pattern='*.log', force=True,
+                                       prefix='IRC logs for ',
+                                       style='xhtmltable', title='IRC logs',
+                                       stable_colours=True))
+        with open(self.filename('somechannel-20130316.log'), 'w') as f:
+            f.write('2013-03-16T12:00:00  <mgedmin> hi\n')
+        process(self.tmpdir, options)
+        with open(self.filename('somechannel-20130316.log.html')) as f:
+            html = f.read()
+        colour = HashNickColourizer()['mgedmin']
+        self.assertIn('style="background: %s"' % colour, html)
+
+    def test_process_with_several_styles(self):
+        self.create('somechannel-20130316.log')
+        options = optparse.Values(dict(searchbox=True, dircproxy=True,
+                                       pattern='*.log', force=False,
+                                       prefix='IRC logs for ',
+                                       style='xhtmltable,ndjson',
+                                       title='IRC logs'))
+        process(self.tmpdir, options)
+        self.assertTrue(os.path.exists(
+            self.filename('somechannel-20130316.log.html')))
+        self.assertTrue(os.path.exists(
+            self.filename('somechannel-20130316.log.ndjson')))
+
+    def test_process_with_jobs(self):
+        os.mkdir(self.filename('serial'))
+        os.mkdir(self.filename('parallel'))
+        for day in range(10, 20):
+            self.create('serial/somechannel-201303%d.log' % day)
+            self.create('parallel/somechannel-201303%d.log' % day)
+        options = dict(searchbox=True, dircproxy=True, pattern='*.log',
+                       force=False, prefix='IRC logs for ',
+                       style='xhtmltable', title='IRC logs')
+        process(self.filename('serial'), optparse.Values(options))
+        options['jobs'] = 3
+        process(self.filename('parallel'), optparse.Values(options))
+        filenames = sorted(os.listdir(self.filename('serial')))
+        self.assertEqual(filenames,
+                         sorted(os.listdir(self.filename('parallel'))))
+        for filename in filenames:
+            with open(self.filename('serial/' + filename), 'rb') as f:
+                serial = f.read()
+            with open(self.filename('parallel/' + filename), 'rb') as f:
+                parallel = f.read()
+            self.assertEqual(serial, parallel, filename)
+
+    def test_process_with_jobs_reports_all_errors(self):
+        for day in range(10, 14):
+            self.create('somechannel-201303%d.log' % day)
+            os.mkdir(self.filename('somechannel-201303%d.log.html' % day))
+        self.create('somechannel-20130314.log')
+        options = optparse.Values(dict(searchbox=True, dircproxy=True,
+                                       pattern='*.log', force=False,
+                                       prefix='IRC logs for ',
+                                       style='xhtmltable', title='IRC logs',
+                                       jobs=2))
+        try:
+            process(self.tmpdir, options)
+        except Error as e:
+            self.assertIn('4 of 5 log files could not be converted', str(e))
+        else:
+            self.fail("process() didn't raise")
+        self.assertTrue(os.path.exists(
+            self.filename('somechannel-20130314.log.html')))
+
+    def process_and_list_changes(self, options):
+        """Run process() and return the names of the HTML files it wrote."""
+        old = 1000000000
+        for name in os.listdir(self.tmpdir):
+            if name.endswith('.html') and name != 'latest.log.html':
+                os.utime(self.filename(name), (old, old))
+        process(self.tmpdir, optparse.Values(options))
+        return sorted(name for name in os.listdir(self.tmpdir)
+                      if name.endswith('.html') and name != 'latest.log.html'
+                      and os.stat(self.filename(name)).st_mtime != old)
+
+    def test_process_with_manifest(self):
+        for day in range(16, 19):
+            self.create('somechannel-201303%d.log' % day, mtime=-100)
+        options = dict(searchbox=True, dircproxy=True, pattern='*.log',
+                       force=False, prefix='IRC logs for ',
+                       style='xhtmltable', title='IRC logs',
+                       manifest=self.filename('manifest.json'))
+        self.assertEqual(self.process_and_list_changes(options),
+                         ['index.html',
+                          'somechannel-20130316.log.html',
+                          'somechannel-20130317.log.html',
+                          'somechannel-20130318.log.html'])
+        # nothing changed
+        self.assertEqual(self.process_and_list_changes(options), [])
+        # mtime changed, contents didn't
+        self.create('somechannel-20130317.log', mtime=-50)
+        self.assertEqual(self.process_and_list_changes(options), [])
+        # contents changed
+        with open(self.filename('somechannel-20130317.log'), 'w') as f:
+            f.write('2013-03-17T12:00:00  <mgedmin> hi\n')
+        self.assertEqual(self.process_and_list_changes(options),
+                         ['somechannel-20130317.log.html'])
+        # a new log changes the next link of the one before it
+        self.create('somechannel-20130319.log')
+        self.assertEqual(self.process_and_list_changes(options),
+                         ['index.html',
+                          'somechannel-20130318.log.html',
+                          'somechannel-20130319.log.html'])
+        # options changed
+        options['prefix'] = 'Logs of '
+        self.assertEqual(self.process_and_list_changes(options),
+                         ['somechannel-20130316.log.html',
+                          'somechannel-20130317.log.html',
+                          'somechannel-20130318.log.html',
+                          'somechannel-20130319.log.html'])
+        options['title'] = 'Logs'
+        self.assertEqual(self.process_and_list_changes(options),
+                         ['index.html'])
+        # a log was removed
+        os.unlink(self.filename('somechannel-20130317.log'))
+        self.assertEqual(self.process_and_list_changes(options),
+                         ['index.html',
+                          'somechannel-20130316.log.html',
+                          'somechannel-20130318.log.html'])
+
+    def test_process_with_damaged_manifest(self):
+        self.create('somechannel-20130316.log', mtime=-100)
+        self.create('somechannel-20130316.log.html', mtime=-50)
+        self.create('somechannel-20130317.log')
+        with open(self.filename('manifest.json'), 'w') as f:
+            f.write('{"format": 1, "vers')
+        options = dict(searchbox=True, dircproxy=True, pattern='*.log',
+                       force=False, prefix='IRC logs for ',
+                       style='xhtmltable', title='IRC logs',
+                       manifest=self.filename('manifest.json'))
+        # without a manifest entry the HTML file is checked like before
+        process(self.tmpdir, optparse.Values(options))
+        manifest = BuildManifest(self.filename('manifest.json'))
+        self.assertEqual(sorted(manifest.logs),
+                         ['somechannel-20130316.log',
+                          'somechannel-20130317.log'])
+        self.assertEqual(manifest.logs['somechannel-20130317.log']['prev'],
+                         ['&#171; Saturday, 2013-03-16',
+                          'somechannel-20130316.log.html'])
+
+    def check_new_log_patches_navigation(self, changes, **options):
+        options = dict(dict(searchbox=True, dircproxy=True, pattern='*.log',
+                            force=False, prefix='IRC logs for ',
+                            style='xhtmltable', title='IRC logs'), **options)
+        # older than the HTML files process_and_list_changes() pretends
+        old = 1000000000 - 100
+        for day in range(16, 18):
+            with open(self.filename('somechannel-201303%d.log' % day),
+                      'w') as f:
+                f.write('2013-03-%dT12:00:00  <mgedmin> hi\n' % day)
+                f.write('2013-03-%dT12:00:01  <mgedmin> hello\n' % day)
+            os.utime(self.filename('somechannel-201303%d.log' % day),
+                     (old, old))
+        process(self.tmpdir, optparse.Values(options))
+        # change the log without making it look changed, to see that it
+        # isn't converted again
+        filename = self.filename('somechannel-20130317.log')
+        st = os.stat(filename)
+        with open(filename, 'w') as f:
+            f.write('2013-03-17T12:00:00  <mgedmin> HI\n')
+            f.write('2013-03-17T12:00:01  <mgedmin> HELLO\n')
+        os.utime(filename, (st.st_atime, st.st_mtime))
+        self.create('somechannel-20130318.log')
+        self.assertEqual(self.process_and_list_changes(options), changes)
+        with open(self.filename(changes[1])) as f:
+            html = f.read()
+        self.assertIn('hello', html)
+        self.assertNotIn('HELLO', html)
+        self.assertEqual(html.count('<a href="somechannel-20130318.log.html">'
+                                    'Monday, 2013-03-18 &#187;</a>'), 2)
+        # the same thing we'd get by converting the log again
+        with open(filename, 'w') as f:
+            f.write('2013-03-17T12:00:00  <mgedmin> hi\n')
+            f.write('2013-03-17T12:00:01  <mgedmin> hello\n')
+        options['force'] = True
+        options.pop('manifest', None)
+        process(self.tmpdir, optparse.Values(options))
+        with open(self.filename(changes[1])) as f:
+            self.assertEqual(f.read(), html)
+
+    def test_process_new_log_patches_navigation(self):
+        self.check_new_log_patches_navigation(
+            ['index.html', 'somechannel-20130317.log.html',
+             'somechannel-20130318.log.html'])
+
+    def test_process_new_log_patches_navigation_with_manifest(self):
+        self.check_new_log_patches_navigation(
+            ['index.html', 'somechannel-20130317.log.html',
+             'somechannel-20130318.log.html'],
+            manifest=self.filename('manifest.json'))
+
+    def test_process_new_log_patches_navigation_of_pages(self):
+        # only the last page links to the next log
+        self.check_new_log_patches_navigation(
+            ['index.html', 'somechannel-20130317.log.p2.html',
+             'somechannel-20130318.log.html'],
+            page_size=1)
+
+    def test_process_new_log_unexpected_navigation(self):
+        self.create('somechannel-20130316.log', mtime=-100)
+        self.create('somechannel-20130316.log.html', mtime=-50)
+        self.create('somechannel-20130317.log')
+        options = dict(searchbox=True, dircproxy=True, pattern='*.log',
+                       force=False, prefix='IRC logs for ',
+                       style='xhtmltable', title='IRC logs')
+        # there's nothing to patch, so the log is converted again
+        self.assertEqual(self.process_and_list_changes(options),
+                         ['index.html',
+                          'somechannel-20130316.log.html',
+                          'somechannel-20130317.log.html'])
+        with open(self.filename('somechannel-20130316.log.html')) as f:
+            self.assertIn('Sunday, 2013-03-17 &#187;', f.read())
+
+    def test_manifest_find_log_files(self):
+        self.create('somechannel-20130316.log')
+        old = 1000000000
+        os.utime(self.tmpdir, (old, old))
+        manifest = BuildManifest(self.filename('manifest.json'))
+        self.assertEqual(manifest.find_log_files(self.tmpdir),
+                         [self.LogFile('somechannel-20130316.log')])
+        # the directory isn't listed again unless its mtime changes
+        self.create('somechannel-20130317.log')
+        os.utime(self.tmpdir, (old, old))
+        self.assertEqual(manifest.find_log_files(self.tmpdir),
+                         [self.LogFile('somechannel-20130316.log')])
+        os.utime(self.tmpdir, (old + 1, old + 1))
+        self.assertEqual(manifest.find_log_files(self.tmpdir),
+                         [self.LogFile('somechannel-20130316.log'),
+                          self.LogFile('somechannel-20130317.log')])
+
+    def test_process_with_gzip(self):
+        self.create('somechannel-20130316.log')
+        self.create('somechannel-20130317.log')
+        options = optparse.Values(dict(searchbox=True, dircproxy=True,
+                                       pattern='*.log', force=False,
+                                       prefix='IRC logs for ',
+                                       style='xhtmltable', title='IRC logs',
+                                       gzip=True, gzip_level=6))
+        process(self.tmpdir, options)
+        for filename in ['index.html', 'somechannel-20130316.log.html',
+                         'somechannel-20130317.log.html']:
+            with open(self.filename(filename), 'rb') as f:
+                html = f.read()
+            with gzip.open(self.filename(filename + '.gz'), 'rb') as f:
+                self.assertEqual(f.read(), html)
+        if hasattr(os, 'symlink'):
+            self.assertEqual(os.readlink(self.filename('latest.log.html.gz')),
+                             'somechannel-20130317.log.html.gz')
+
+    def test_process_skips_up_to_date_compressed_logs(self):
+        for day in ['20130316', '20130317']:
+            fn = self.filename('somechannel-%s.log.gz' % day)
+            with gzip.open(fn, 'wb') as f:
+                f.write(b'<mg> hello\n')
+            mtime = self.start_time - 100
+            os.utime(fn, (mtime, mtime))
+        options = optparse.Values(dict(searchbox=True, dircproxy=True,
+                                       pattern='*.log.gz', force=False,
+                                       prefix='IRC logs for ',
+                                       style='xhtmltable', title='IRC logs',
+                                       gzip=True, gzip_level=6))
+        process(self.tmpdir, options)
+        outputs = ['somechannel-20130316.log.html',
+                   'somechannel-20130316.log.html.gz',
+                   'somechannel-20130317.log.html',
+                   'somechannel-20130317.log.html.gz']
+        mtime = self.start_time - 50
+        for filename in outputs:
+            os.utime(self.filename(filename), (mtime, mtime))
+        process(self.tmpdir, options)
+        for filename in outputs:
+            self.assertEqual(os.stat(self.filename(filename)).st_mtime, mtime)
+
+    def test_process_with_gzip_and_several_styles(self):
+        self.create('somechannel-20130316.log')
+        self.create('somechannel-20130317.log')
+        for jobs in [1, 2]:
+            options = optparse.Values(dict(searchbox=True, dircproxy=True,
+                                           pattern='*.log', force=True,
+                                           prefix='IRC logs for ',
+                                           style='xhtmltable,ndjson',
+                                           title='IRC logs', jobs=jobs,
+                                           gzip=True, gzip_level=6))
+            process(self.tmpdir, options)
+            for filename in ['somechannel-20130316.log.ndjson',
+                             'somechannel-20130317.log.ndjson']:
+                with open(self.filename(filename), 'rb') as f:
+                    data = f.read()
+                with gzip.open(self.filename(filename + '.gz'), 'rb') as f:
+                    self.assertEqual(f.read(), data)
+                os.remove(self.filename(filename + '.gz'))
+
     def test_process_copies_css_even_when_all_logs_up_to_date(self):
         self.create('somechannel-20130316.log', mtime=-10)
         self.create('somechannel-20130316.log.html')